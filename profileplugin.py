@@ -40,11 +40,16 @@ except:
 
 from . import resources
 from .tools.profiletool_core import ProfileToolCore
+from .tools.profileprocessing import ProfileToolProvider
 
 class ProfilePlugin:
 
     def __init__(self, iface):
         self.iface = iface
+        self.provider = None           #processing provider of the batch profile algorithms
+        if iface is None:
+            # loaded by qgis_process, for the processing algorithms only
+            return
         self.canvas = iface.mapCanvas()
         self.profiletool = None
         self.dockOpened = False        #remember for not reopening dock if there's already one opened
@@ -54,7 +59,14 @@ class ProfilePlugin:
         self.canvas.mapToolSet.connect(self.mapToolChanged)
 
 
+    def initProcessing(self):
+        self.provider = ProfileToolProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
     def initGui(self):
+        if self.provider is None:
+            # QGIS < 3.8 doesn't call initProcessing
+            self.initProcessing()
         # create action
         self.action = QAction(QIcon(":/plugins/profiletool/icons/profileIcon.png"), "Terrain profile", self.iface.mainWindow())
         self.action.setWhatsThis("Plots terrain profiles")
@@ -83,6 +95,10 @@ class ProfilePlugin:
         self.iface.removePluginMenu("&Profile Tool", self.action)
         self.iface.removePluginMenu("&Profile Tool", self.aboutAction)
 
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
+
 
     def run(self):
 
@@ -130,6 +130,7 @@ class PlotDataItem(GraphicsObject):
         self.yData = None
         self.xDisp = None
         self.yDisp = None
+        self.pyramid = None  ## MinMaxPyramid of the data, built when first needed
         #self.dataMask = None
         #self.curves = []
         #self.scatters = []
@@ -458,6 +459,7 @@ class PlotDataItem(GraphicsObject):
         self.xClean = self.yClean = None
         self.xDisp = None
         self.yDisp = None
+        self.pyramid = None
         profiler('set data')
         
         self.updateItems()
@@ -526,44 +528,39 @@ class PlotDataItem(GraphicsObject):
             if not isinstance(ds, int):
                 ds = 1
                 
-            if self.opts['autoDownsample']:
-                # this option presumes that x-values have uniform spacing
-                range = self.viewRect()
-                if range is not None and len(x) > 1:
-                    dx = float(x[-1]-x[0]) / (len(x)-1)
-                    if dx != 0.0:
-                        x0 = (range.left()-x[0]) / dx
-                        x1 = (range.right()-x[0]) / dx
-                        width = self.getViewBox().width()
-                        if width != 0.0:
-                            ds = int(max(1, int((x1-x0) / (width*self.opts['autoDownsampleFactor']))))
-                        ## downsampling is expensive; delay until after clipping.
-            
-            if self.opts['clipToView']:
+            range = self.viewRect()
+            clip = False
+            x0, x1 = 0, len(x)
+            if self.opts['clipToView'] and range is not None and len(x) > 1:
                 view = self.getViewBox()
                 if view is None or not view.autoRangeEnabled()[0]:
                     # this option presumes that x-values are in increasing order
-                    range = self.viewRect()
-                    if range is not None and len(x) > 1:
-                        # clip to visible region extended by downsampling value, assuming
-                        # uniform spacing of x-values, has O(1) performance
-                        dx = float(x[-1]-x[0]) / (len(x)-1)
-                        x0 = np.clip(int((range.left()-x[0])/dx) - 1*ds, 0, len(x)-1)
-                        x1 = np.clip(int((range.right()-x[0])/dx) + 2*ds, 0, len(x)-1)
-                        
-                        # if data has been clipped too strongly (in case of non-uniform 
-                        # spacing of x-values), refine the clipping region as required
-                        # worst case performance: O(log(n))
-                        # best case performance: O(1)
-                        if x[x0] > range.left():
-                            x0 = np.searchsorted(x, range.left()) - 1*ds
-                            x0 = np.clip(x0, a_min=0, a_max=len(x))
-                        if x[x1] < range.right():
-                            x1 = np.searchsorted(x, range.right()) + 2*ds
-                            x1 = np.clip(x1, a_min=0, a_max=len(x))
+                    # binary search of the visible region, O(log(n)) whatever
+                    # the spacing of x-values
+                    clip = True
+                    x0 = np.searchsorted(x, range.left())
+                    x1 = np.searchsorted(x, range.right(), side='right')
+                    
+            if self.opts['autoDownsample'] and range is not None and len(x) > 1:
+                width = self.getViewBox().width()
+                span = float(x[-1]-x[0])
+                if clip:
+                    # exact count of the samples in view, for any spacing
+                    visible = x1 - x0
+                elif span != 0.0:
+                    # this presumes that x-values have uniform spacing
+                    visible = len(x) * range.width() / abs(span)
+                else:
+                    visible = 0
+                if width != 0.0:
+                    ds = int(max(1, int(visible / (width*self.opts['autoDownsampleFactor']))))
                     
-                        x = x[x0:x1]
-                        y = y[x0:x1]
+            if clip:
+                # clip to visible region extended by downsampling value
+                x0 = max(x0 - 1*ds, 0)
+                x1 = min(x1 + 2*ds, len(x))
+                x = x[x0:x1]
+                y = y[x0:x1]
                     
             if ds > 1:
                 if self.opts['downsampleMethod'] == 'subsample':
@@ -574,15 +571,14 @@ class PlotDataItem(GraphicsObject):
                     x = x[:n*ds:ds]
                     y = y[:n*ds].reshape(n,ds).mean(axis=1)
                 elif self.opts['downsampleMethod'] == 'peak':
-                    n = len(x) // ds
-                    x1 = np.empty((n,2))
-                    x1[:] = x[:n*ds:ds,np.newaxis]
-                    x = x1.reshape(n*2)
-                    y1 = np.empty((n,2))
-                    y2 = y[:n*ds].reshape((n, ds))
-                    y1[:,0] = y2.max(axis=1)
-                    y1[:,1] = y2.min(axis=1)
-                    y = y1.reshape(n*2)
+                    if self.opts['fftMode'] or any(self.opts['logMode']):
+                        x, y = peakDownsample(x, y, ds)
+                    else:
+                        # read from the min/max pyramid of the data, built
+                        # once per setData: O(points drawn) for any view
+                        if self.pyramid is None:
+                            self.pyramid = MinMaxPyramid(self.xData, self.yData)
+                        x, y = self.pyramid.downsample(x0, x1, ds)
                 
                     
             self.xDisp = x
@@ -610,7 +606,18 @@ class PlotDataItem(GraphicsObject):
         """
         
         range = [None, None]
-        if self.curve.isVisible():
+        if (self.opts['clipToView'] and frac >= 1.0 and self.xData is not None
+                and not self.opts['fftMode'] and not any(self.opts['logMode'])):
+            # the curve only holds the data in view: measure all of it
+            data = (self.xData, self.yData)
+            d = data[ax]
+            if orthoRange is not None:
+                d2 = data[1-ax]
+                d = d[(d2 >= orthoRange[0]) & (d2 <= orthoRange[1])]
+            d = d[np.isfinite(d)]
+            if len(d) > 0:
+                range = [d.min(), d.max()]
+        elif self.curve.isVisible():
             range = self.curve.dataBounds(ax, frac, orthoRange)
         elif self.scatter.isVisible():
             r2 = self.scatter.dataBounds(ax, frac, orthoRange)
@@ -645,6 +652,7 @@ class PlotDataItem(GraphicsObject):
         #self.yClean = None
         self.xDisp = None
         self.yDisp = None
+        self.pyramid = None
         self.curve.clear()
         self.scatter.clear()
 
@@ -708,9 +716,92 @@ def dataType(obj):
         
 def isSequence(obj):
     return hasattr(obj, '__iter__') or isinstance(obj, np.ndarray) or (hasattr(obj, 'implements') and obj.implements('MetaArray'))
+
+
+def peakDownsample(x, y, ds):
+    """
+    Downsample (x, y) by a factor *ds*, following the first, max, min and
+    last values of y in each bin of samples. See :class:`MinMaxPyramid`.
+    """
+    return MinMaxPyramid(x, y, levels=1).downsample(0, len(x), ds)
+
+
+class MinMaxPyramid(object):
+    """
+    Multi-resolution min/max summary of a series (x, y), which downsamples
+    any window of the series at a cost proportional to the number of points
+    drawn rather than to the number of samples in the window.
     
+    Level k holds, for each block of 2**k consecutive samples, the x of its
+    first and last samples and the first, last, min and max of its y values,
+    NaN values being ignored by min and max. Level 0 is the data itself, and
+    each level is built from the previous one, all in O(n).
+    
+    Downsampled windows are made of bins of about *ds* samples, each drawn
+    as four points: its first, max, min and last values, so that the lines
+    joining consecutive bins are those of the data. When x is increasing,
+    the bins have the same width along x, so that non-uniformly spaced
+    series keep the spikes of their densely sampled parts.
+    """
+    
+    def __init__(self, x, y, levels=None):
+        x = np.asarray(x)
+        y = np.asarray(y, dtype=float)
+        self.increasing = len(x) < 2 or bool(np.all(x[1:] >= x[:-1]))
+        level = (x, x, y, y, y, y)
+        self.levels = [level]
+        while len(level[0]) > 1 and (levels is None or len(self.levels) < levels):
+            level = self._coarsen(level)
+            self.levels.append(level)
             
-            
+    @staticmethod
+    def _coarsen(level):
+        ## merge the blocks of level two by two
+        xFirst, xLast, yFirst, yLast, yMin, yMax = level
+        n = len(xFirst)
+        starts = np.arange(0, n, 2)
+        ends = np.minimum(starts + 1, n - 1)
+        return (xFirst[starts], xLast[ends], yFirst[starts], yLast[ends],
+                np.fmin.reduceat(yMin, starts), np.fmax.reduceat(yMax, starts))
+        
+    def downsample(self, start, stop, ds):
+        """
+        Return the downsampled x, y of the samples start:stop, by a factor
+        of about *ds*. The window is widened to whole blocks of the level
+        read, by less than ds/2 samples on each side.
+        """
+        if stop <= start:
+            return np.empty(0), np.empty(0)
+        ## coarsest level with a few blocks per bin
+        k = 0
+        while 4 << k <= ds and k + 1 < len(self.levels):
+            k += 1
+        b0 = start >> k
+        b1 = ((stop - 1) >> k) + 1
+        xFirst, xLast, yFirst, yLast, yMin, yMax = [a[b0:b1] for a in self.levels[k]]
+        blocks = len(xFirst)
+        per = float(ds) / (1 << k)  ## blocks per bin
+        starts = None
+        if self.increasing and blocks > 1:
+            step = float(xLast[-1] - xFirst[0]) * per / blocks
+            if step > 0 and np.isfinite(step):
+                edges = xFirst[0] + step * np.arange(int(np.ceil(blocks / per)))
+                starts = np.unique(np.searchsorted(xFirst, edges))
+                starts = starts[starts < blocks]
+        if starts is None:
+            starts = np.arange(0, blocks, max(1, int(per)))
+        ends = np.append(starts[1:], blocks) - 1
+        x = np.empty((len(starts), 4))
+        x[:, :3] = xFirst[starts, np.newaxis]
+        x[:, 3] = xLast[ends]
+        y = np.empty((len(starts), 4))
+        y[:, 0] = yFirst[starts]
+        y[:, 1] = np.fmax.reduceat(yMax, starts)
+        y[:, 2] = np.fmin.reduceat(yMin, starts)
+        y[:, 3] = yLast[ends]
+        return x.reshape(-1), y.reshape(-1)
+    
+    
 #class TableData:
     #"""
     #Class for presenting multiple forms of tabular data through a consistent interface.
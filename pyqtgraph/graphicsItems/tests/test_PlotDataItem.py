@@ -86,3 +86,67 @@ def test_clipping():
 
         assert xDisp[0] <= vr.left()
         assert xDisp[-1] >= vr.right()
+
+def test_peak_downsampling_nonuniform():
+    from pyqtgraph.graphicsItems.PlotDataItem import peakDownsample
+    # dense samples followed by sparse ones, with spikes in both parts
+    x = np.concatenate([np.linspace(0, 1, 10000, endpoint=False),
+                        np.linspace(1, 100, 100)])
+    y = np.zeros(len(x))
+    y[5000] = 10.
+    y[10050] = -10.
+    y[100:200] = np.nan
+
+    xd, yd = peakDownsample(x, y, 50)
+    assert len(xd) < len(x) // 10
+    assert np.nanmax(yd) == 10.
+    assert np.nanmin(yd) == -10.
+    # nan values are ignored, the curve ends at the last sample
+    assert not np.isnan(yd).any()
+    assert xd[0] == x[0] and xd[-1] == x[-1]
+    assert np.all(np.diff(xd) >= 0)
+
+def test_minmax_pyramid():
+    from pyqtgraph.graphicsItems.PlotDataItem import MinMaxPyramid
+    n = 100003
+    x = np.cumsum(np.random.exponential(size=n))
+    x[:n//2] *= 0.01  # non-uniform spacing
+    y = np.random.normal(size=n)
+    y[np.random.randint(0, n, 100)] = np.nan
+    pyramid = MinMaxPyramid(x, y)
+
+    for ds in [2, 3, 17, 100, 1000, 50000]:
+        start = np.random.randint(0, n // 2)
+        stop = np.random.randint(start + 1, n + 1)
+        xd, yd = pyramid.downsample(start, stop, ds)
+        assert len(xd) <= 8 * ((stop - start) // ds + 2)
+        assert np.all(np.diff(xd) >= 0)
+        # same extrema as the samples of the window, widened to whole blocks
+        assert xd[0] <= x[start] and xd[-1] >= x[stop-1]
+        first = np.searchsorted(x, xd[0])
+        last = np.searchsorted(x, xd[-1], side='right')
+        assert first > start - ds / 2. and last < stop + ds / 2.
+        assert np.nanmax(yd) == np.nanmax(y[first:last])
+        assert np.nanmin(yd) == np.nanmin(y[first:last])
+
+def test_minmax_pyramid_cache():
+    x = np.arange(10000.)
+    y = np.random.normal(size=10000)
+    w = pg.PlotWidget()
+    c = pg.PlotDataItem(x, y, downsample=10, downsampleMethod='peak')
+    w.addItem(c)
+    assert c.pyramid is None  # built when first needed
+
+    xd, yd = c.getData()
+    pyramid = c.pyramid
+    assert pyramid is not None
+    assert yd.max() == y.max() and yd.min() == y.min()
+    c.setDownsampling(ds=100)
+    c.getData()
+    assert c.pyramid is pyramid
+
+    c.setData(x, -y)
+    assert c.pyramid is None
+    xd, yd = c.getData()
+    assert c.pyramid is not pyramid
+    assert yd.max() == -y.min()
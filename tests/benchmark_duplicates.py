@@ -0,0 +1,105 @@
+"""Benchmark of DataReaderTool.removeDuplicateLenght.
+
+Compares it with the former quadratic implementation on random projected
+points, and checks both give the same points: on chainages on a grid, on
+dense random chainages and on chains of points closer than the precision. Run it from the QGIS python
+console, or with a python interpreter which can import qgis.
+The former implementation is only run up to LEGACY_MAX points (it takes
+several minutes on 100000 points), its duration on more points is
+extrapolated from the last run, as it grows with the square of the count.
+"""
+import time
+
+import numpy as np
+
+from profiletool.tools.dataReaderTool import DataReaderTool, PROJECTED_POINT
+
+
+SIZES = [10000, 100000, 1000000]
+LEGACY_MAX = 10000
+
+
+def legacyRemoveDuplicateLenght(projectedpoints):
+    projectedpointsfinal = []
+    duplicate = []
+    PRECISION = 0.01
+
+    for i in range(len(projectedpoints)):
+        if i in duplicate:
+            continue
+        else:
+            mindist = np.absolute(projectedpoints[:,0] - projectedpoints[i,0])
+            mindistindex = np.where(mindist < PRECISION)
+            #insert closest point
+            closestindex = np.argmin(projectedpoints[mindistindex[0],3])
+            projectedpointsfinal.append(projectedpoints[mindistindex[0][closestindex]])
+            duplicate += mindistindex[0].tolist()
+
+    projectedpoints = np.array(projectedpointsfinal)
+    projectedpoints = projectedpoints[projectedpoints[:,0].argsort()]
+    return projectedpoints
+
+
+def randomProjectedPoints(count, seed=0):
+    """Projected points with about one duplicate chainage out of two."""
+    rng = np.random.default_rng(seed)
+    projectedpoints = np.zeros(count, dtype=PROJECTED_POINT)
+    projectedpoints["chainage"] = rng.integers(0, count, count) * 0.05
+    projectedpoints["px"] = projectedpoints["chainage"]
+    projectedpoints["offset"] = rng.uniform(0, 10, count)
+    projectedpoints["value"] = rng.uniform(0, 100, count)
+    projectedpoints["ox"] = projectedpoints["chainage"]
+    projectedpoints["oy"] = projectedpoints["offset"]
+    projectedpoints["fid"] = np.arange(count)
+    return projectedpoints
+
+
+def denseProjectedPoints(count, seed=0):
+    """Projected points with random chainages, about two per precision."""
+    projectedpoints = randomProjectedPoints(count, seed)
+    rng = np.random.default_rng(seed + 1)
+    projectedpoints["chainage"] = rng.uniform(0, count * 0.005, count)
+    return projectedpoints
+
+
+def chainedProjectedPoints(count, seed=0):
+    """Projected points 0.009 apart, in a random order: each one is closer
+    than the precision to its neighbours."""
+    projectedpoints = randomProjectedPoints(count, seed)
+    rng = np.random.default_rng(seed + 1)
+    projectedpoints["chainage"] = rng.permutation(count) * 0.009
+    return projectedpoints
+
+
+GENERATORS = [randomProjectedPoints, denseProjectedPoints,
+              chainedProjectedPoints]
+
+
+def timed(function, projectedpoints):
+    start = time.perf_counter()
+    result = function(projectedpoints)
+    return result, time.perf_counter() - start
+
+
+for generator in GENERATORS:
+    print(generator.__name__)
+    legacycount = legacyduration = None
+    for count in SIZES:
+        projectedpoints = generator(count)
+        result, duration = timed(DataReaderTool().removeDuplicateLenght,
+                                 projectedpoints)
+        message = "%8d points : %8.3f s" % (count, duration)
+        if count <= LEGACY_MAX:
+            # the former implementation worked on object arrays
+            legacy, legacyduration = timed(
+                legacyRemoveDuplicateLenght,
+                np.array(projectedpoints.tolist(), dtype=object))
+            assert np.array_equal(result["fid"], legacy[:,8].astype(np.int64))
+            legacycount = count
+            message += ", former : %8.3f s (x%.0f)" % (
+                legacyduration, legacyduration / duration)
+        elif legacycount is not None:
+            estimate = legacyduration * (count / legacycount) ** 2
+            message += ", former : ~%7.0f s (x%.0f, extrapolated)" % (
+                estimate, estimate / duration)
+        print(message)
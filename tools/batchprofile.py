@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+#-----------------------------------------------------------
+#
+# Profile
+# Copyright (C) 2008  Borys Jurgiel
+# Copyright (C) 2012  Patrice Verchere
+#-----------------------------------------------------------
+#
+# licensed under the terms of GNU GPL 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, print to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#---------------------------------------------------------------------
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import multiprocessing
+import os
+import sys
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import *
+
+from .dataReaderTool import DataReaderTool
+from .pointindex import PointGridIndex
+from .profilecache import ProfileCache
+from .rastersampler import createSampler
+
+
+class BatchProfiler:
+    """Compute the profiles of every feature of a line layer, without the
+    map canvas.
+
+    Each target is a dictionnary : {"layer" : raster or point vector layer,
+                                    "band" : raster band, or index of the
+                                             value field of a vector layer,
+                                    "buffer" : search buffer of a vector
+                                               layer, else None}
+    The targets yielded by profiles() also hold the "xform" from the line
+    layer crs to their layer crs.
+    The targets are read with one DataReaderTool each, kept for all the
+    lines, so that consecutive lines share the raster tiles and the point
+    index already read. Memory use is bounded by maxTiles raster tiles per
+    target and maxSamples cached samples, whatever the number of lines.
+    Create it from the main thread: the targets' data sources are cloned
+    here, and profiles() can then run in a background thread.
+    """
+
+    def __init__(self, lineSource, lineCrs, targets, resolution_mode="full",
+                 interpolation="nearest", transformContext=None,
+                 maxTiles=16, maxSamples=5000000):
+        self.lineSource = lineSource
+        self.resolution_mode = resolution_mode
+        self.interpolation = interpolation
+        if transformContext is None:
+            transformContext = QgsProject.instance().transformContext()
+        self.cache = ProfileCache(maxSamples)
+        self.targets = []
+        for target in targets:
+            layer = target["layer"]
+            if layer.type() == QgsMapLayer.VectorLayer:
+                source = QgsVectorLayerFeatureSource(layer)
+            else:
+                source = layer.dataProvider().clone()
+            xform = QgsCoordinateTransform(lineCrs, layer.crs(), transformContext)
+            reader = DataReaderTool(QgsFeedback(), xform, source, self.cache)
+            if layer.type() == QgsMapLayer.VectorLayer:
+                reader.indexable = PointGridIndex.canIndex(layer)
+            if target.get("buffer") is None:
+                reader.sampler = createSampler(source, target["band"],
+                                               maxTiles=maxTiles)
+            self.targets.append((dict(target, xform=xform), reader))
+
+    def cancel(self):
+        for _, reader in self.targets:
+            reader.feedback.cancel()
+
+    def profiles(self, request=None):
+        """Yield (line feature, part, target, profile) for each part of each
+        line feature and each target, one profile at a time.
+
+        profile is the dictionnary returned by DataReaderTool, its lenghts
+        in the line layer crs units and its x, y in the target layer crs.
+        Raise ProfileCanceledError once cancel() has been called.
+        """
+        if request is None:
+            request = QgsFeatureRequest()
+        for feature in self.lineSource.getFeatures(request):
+            geometry = feature.geometry()
+            if geometry.isEmpty():
+                continue
+            if geometry.isMultipart():
+                polylines = geometry.asMultiPolyline()
+            else:
+                polylines = [geometry.asPolyline()]
+            for part, polyline in enumerate(polylines):
+                pointstoDraw = [[point.x(), point.y()] for point in polyline]
+                for target, reader in self.targets:
+                    profile = {"layer": target["layer"], "band": target["band"]}
+                    if target.get("buffer") is not None:
+                        profile = reader.dataVectorReaderTool(
+                            None, None, profile, pointstoDraw, target["buffer"])
+                    else:
+                        profile = reader.dataRasterReaderTool(
+                            None, None, profile, pointstoDraw,
+                            self.resolution_mode, self.interpolation)
+                    yield feature, part, target, profile
+
+
+def profileFields():
+    """Fields of the points written for each profile sample, see profileRows."""
+    fields = QgsFields()
+    fields.append(QgsField("line_fid", QVariant.LongLong))
+    fields.append(QgsField("part", QVariant.Int))
+    fields.append(QgsField("layer", QVariant.String))
+    fields.append(QgsField("band", QVariant.Int))
+    fields.append(QgsField("distance", QVariant.Double))
+    fields.append(QgsField("value", QVariant.Double))
+    return fields
+
+
+def profileRows(line, part, target, profile):
+    """Return one (x, y, attributes) tuple per sample of profile, x and y in
+    the line layer crs and attributes matching profileFields()."""
+    if len(profile["l"]) == 0:
+        return []
+    points = QgsGeometry.fromMultiPointXY(
+        [QgsPointXY(x, y) for x, y in zip(profile["x"], profile["y"])])
+    points.transform(target["xform"], QgsCoordinateTransform.ReverseTransform)
+    return [(point.x(), point.y(),
+             [line.id(), part, target["layer"].name(), target["band"],
+              float(l), None if z is None else float(z)])
+            for point, l, z in zip(points.asMultiPoint(), profile["l"],
+                                   profile["z"])]
+
+
+def rowsToFeatures(rows):
+    features = []
+    for x, y, attributes in rows:
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+        feature.setAttributes(attributes)
+        features.append(feature)
+    return features
+
+
+class ParallelBatchProfiler:
+    """Run a BatchProfiler on the line features, sharded on a process pool.
+
+    The line ids are split in chunks of chunkSize consecutive features,
+    each one profiled by a worker process which opens the layers itself
+    from their source and keeps them, with their tiles and point index,
+    for its next chunks. The rows of the chunks are returned in feature
+    order, with at most two chunks per worker waiting to be read.
+    Workers are started with the "spawn" method and initialize their own
+    QgsApplication, so this must run from a python interpreter, not from
+    inside the QGIS application.
+    """
+
+    def __init__(self, lineLayer, targets, resolution_mode="full",
+                 interpolation="nearest", workers=None, chunkSize=64):
+        self.lineLayer = lineLayer
+        self.lineSpec = _layerSpec(lineLayer)
+        self.targetSpecs = [(_layerSpec(target["layer"]), target["band"],
+                             target.get("buffer")) for target in targets]
+        self.resolution_mode = resolution_mode
+        self.interpolation = interpolation
+        self.workers = workers or os.cpu_count() or 1
+        self.chunkSize = chunkSize
+
+    def rows(self, request=None):
+        """Yield the lists of rows (see profileRows) of the chunks of
+        line features, in feature order."""
+        if request is None:
+            request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry).setNoAttributes()
+        fids = [feature.id() for feature in self.lineLayer.getFeatures(request)]
+        chunks = [fids[i:i + self.chunkSize]
+                  for i in range(0, len(fids), self.chunkSize)]
+        with ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initWorker,
+                initargs=(QgsApplication.prefixPath(),)) as executor:
+            pending = []
+            for chunk in chunks:
+                pending.append(executor.submit(
+                    _profileChunk, self.lineSpec, self.targetSpecs, chunk,
+                    self.resolution_mode, self.interpolation))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+
+def _layerSpec(layer):
+    """Return what a worker needs to open layer again."""
+    return (layer.type(), layer.source(), layer.name(), layer.providerType())
+
+
+def _openLayer(spec):
+    layertype, source, name, provider = spec
+    if layertype == QgsMapLayer.RasterLayer:
+        return QgsRasterLayer(source, name, provider)
+    return QgsVectorLayer(source, name, provider)
+
+
+# state of a worker process: its QgsApplication and, for the last layers
+# it was given, (line layer, BatchProfiler)
+_worker = {}
+
+
+def _initWorker(prefixPath):
+    QgsApplication.setPrefixPath(prefixPath, True)
+    _worker["application"] = QgsApplication([], False)
+    _worker["application"].initQgis()
+
+
+def _profileChunk(lineSpec, targetSpecs, fids, resolution_mode, interpolation):
+    key = (lineSpec, tuple(targetSpecs), resolution_mode, interpolation)
+    if _worker.get("key") != key:
+        lineLayer = _openLayer(lineSpec)
+        targets = [{"layer": _openLayer(spec), "band": band, "buffer": buffer}
+                   for spec, band, buffer in targetSpecs]
+        _worker["key"] = key
+        _worker["profiler"] = (lineLayer, BatchProfiler(
+            lineLayer, lineLayer.crs(), targets, resolution_mode, interpolation))
+    lineLayer, profiler = _worker["profiler"]
+    rows = []
+    for line, part, target, profile in profiler.profiles(
+            QgsFeatureRequest().setFilterFids(fids)):
+        rows += profileRows(line, part, target, profile)
+    # features requested by id may come in any order
+    order = {fid: i for i, fid in enumerate(fids)}
+    rows.sort(key=lambda row: order[row[2][0]])
+    return rows
+
+
+def main(argv=None):
+    """Command line profiling of a line layer, on all the cpu cores :
+        python -m profiletool.tools.batchprofile lines.gpkg dem.tif
+            points.shp --field z -o profiles.gpkg
+    QGIS_PREFIX_PATH must be set as for any standalone PyQGIS script.
+    """
+    parser = argparse.ArgumentParser(
+        description="Extract the profiles of every line of a layer.")
+    parser.add_argument("lines", help="line layer")
+    parser.add_argument("layers", nargs="+", help="raster and point layers")
+    parser.add_argument("-o", "--output", required=True,
+                        help="output file, its format given by its extension")
+    parser.add_argument("--band", type=int, default=1, help="raster band")
+    parser.add_argument("--field", default="",
+                        help="value field of the point layers")
+    parser.add_argument("--buffer", type=float, default=10.0,
+                        help="search buffer of the point layers")
+    parser.add_argument("--resolution", default="full",
+                        choices=["samples", "limited", "full", "cells"])
+    parser.add_argument("--interpolation", default="nearest",
+                        choices=["nearest", "bilinear", "bicubic"])
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes, default one per cpu")
+    args = parser.parse_args(argv)
+
+    application = QgsApplication([], False)
+    application.initQgis()
+
+    lineLayer = QgsVectorLayer(args.lines, "lines", "ogr")
+    if (not lineLayer.isValid() or
+            lineLayer.geometryType() != QgsWkbTypes.LineGeometry):
+        parser.error("%s is not a line layer" % args.lines)
+    targets = []
+    for path in args.layers:
+        layer = QgsRasterLayer(path, os.path.basename(path))
+        if layer.isValid():
+            targets.append({"layer": layer, "band": args.band, "buffer": None})
+            continue
+        layer = QgsVectorLayer(path, os.path.basename(path), "ogr")
+        field = layer.fields().lookupField(args.field)
+        if (not layer.isValid() or field < 0 or
+                layer.geometryType() != QgsWkbTypes.PointGeometry):
+            parser.error("%s is not a raster or a point layer with a %s field"
+                         % (path, args.field))
+        targets.append({"layer": layer, "band": field, "buffer": args.buffer})
+
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = QgsVectorFileWriter.driverForExtension(
+        os.path.splitext(args.output)[1])
+    writer = QgsVectorFileWriter.create(
+        args.output, profileFields(), QgsWkbTypes.Point, lineLayer.crs(),
+        QgsProject.instance().transformContext(), options)
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        parser.error("%s can't be written: %s"
+                     % (args.output, writer.errorMessage()))
+    profiler = ParallelBatchProfiler(lineLayer, targets, args.resolution,
+                                     args.interpolation, args.workers)
+    for rows in profiler.rows():
+        writer.addFeatures(rowsToFeatures(rows), QgsFeatureSink.FastInsert)
+    del writer
+    application.exitQgis()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -28,124 +28,529 @@ import qgis
 import numpy as np
 
 import platform
+import warnings
 from math import sqrt
 from .utils import isProfilable
+from .rastersampler import RasterBlockSampler, createSampler, overviewFactors
+from .pointindex import PointGridIndex, projectOnPolyline
+from .meshsampler import (MeshSampler, activeDatasetIndex, activeScalarValues,
+                          scalarValues)
 
 
-class DataReaderTool:
+# record of a point of a vector layer projected on the polyline
+PROJECTED_POINT = np.dtype([
+    ("chainage", np.float64),   # lenght along the polyline of the projected point
+    ("px", np.float64),         # x of the projected point
+    ("py", np.float64),         # y of the projected point
+    ("offset", np.float64),     # distance from the point to the polyline, -1 if interpolated
+    ("segment", np.int64),      # segment of the polyline it is projected on, -1 if interpolated
+    ("value", np.float64),      # value of the band field, nan if none
+    ("ox", np.float64),         # x of the original point
+    ("oy", np.float64),         # y of the original point
+    ("fid", np.int64)])         # id of the original feature, -1 if interpolated
+
+
+# percentiles of the swath values, besides their min, mean and max
+SWATH_PERCENTILES = (25, 75)
+# most samples read across a swath at once
+SWATH_MAX_POINTS = 4000000
 
-    """def __init__(self):
-        self.profiles = None"""
 
-    def dataRasterReaderTool(self, iface1,tool1, profile1, pointstoDraw1, resolution_mode):
+class ProfileCanceledError(Exception):
+    """Raised by a reader when its feedback has been canceled."""
+
+
+class DataReaderTool:
+
+    def __init__(self, feedback=None, xform=None, source=None, cache=None,
+                 maxTiles=None):
+        """
+        feedback : QgsFeedback receiving the progress and cancel requests,
+                   else progress is shown in the status bar
+        xform : QgsCoordinateTransform from the polyline crs to the layer crs,
+                else map canvas crs to layer crs
+        source : data provider clone (raster) or QgsVectorLayerFeatureSource
+                 (vector) to read from, else the layer itself.
+        cache : ProfileCache keeping the samples of each raster segment and
+                the vector profiles, to only compute what has changed.
+        maxTiles : number of raster tiles kept by the samplers of the
+                   reader, else all the tiles read are kept
+        The vector profiles are only cached while self.cachable, and the
+        points only read through a PointGridIndex if self.indexable, else
+        checked on the layer. Both are set from the main thread for the
+        layer being read, see profiletask.computeProfile: the cache entries
+        and indexes of a layer are removed when its data changes.
+        Give feedback, xform and source to use the reader outside the main thread.
+        A reader used for several profiles of the same raster band keeps its
+        RasterBlockSampler, and so the tiles already read.
+        """
+        self.feedback = feedback
+        self.xform = xform
+        self.source = source
+        self.cache = cache
+        self.maxTiles = maxTiles
+        self.cachable = True
+        self.indexable = None
+        self.sampler = None
+        self.levels = {}        # samplers of the overviews of self.sampler
+        self.factors = None     # decimation factors of these overviews
+        self.meshvalues = None  # values of the mesh layer dataset read
+
+    def dataRasterReaderTool(self, iface1,tool1, profile1, pointstoDraw1, resolution_mode,
+                             interpolation="nearest", spacing=None):
         """
+        resolution_mode : "samples", "limited", "full" or "cells" (one sample
+                          at each raster cell edge crossed by the polyline)
+        interpolation : one of rastersampler.INTERPOLATIONS, used for raster
+                        layers read by blocks
+        spacing : in "limited" mode, the distance between samples in map
+                  units, else at most 1000 samples per segment
         Return a dictionnary : {"layer" : layer read,
                                 "band" : band read,
                                 "l" : array of computed lenght,
-                                "z" : array of computed z
+                                "z" : array of computed z,
+                                "x", "y" : arrays of the sample coordinates
+                                           in the layer crs}
+        In "limited" mode, raster layers read by blocks are read from the
+        overview matching the samples spacing, and the dictionnary also
+        holds "zmin" and "zmax" : the envelope of the values between the
+        samples.
+        band may be a tuple of raster bands, all read together: "z" is then
+        the mean of the bands at each sample, and the dictionnary also holds
+        "zbands" : the (bands, samples) array of their values, nan where
+        undefined.
         """
         #init
         self.tool = tool1                        #needed to transform point coordinates
         self.profiles = profile1                #profile with layer and band to compute
         self.pointstoDraw = pointstoDraw1        #the polyline to compute
         self.iface = iface1                        #QGis interface to show messages in status bar
+        self.spacing = spacing
+        layer = self.profiles["layer"]
+        if layer.type() == layer.RasterLayer:
+            self.provider = self.source or layer.dataProvider()
+        else:
+            self.provider = None
+        if layer.type() == layer.MeshLayer:
+            self.meshvalues = self._meshValues(layer)
+        if (self.sampler is not None and self.sampler.provider is self.provider
+                and self.sampler.band == self.profiles["band"]):
+            pass    # same band as the previous profile: keep its tiles
+        else:
+            self.sampler = createSampler(
+                self.provider, self.profiles["band"], self._status_update,
+                self.maxTiles)
+            self.levels = {}
+            self.factors = None
 
-        distance = qgis.core.QgsDistanceArea()
-
-        #Get the values on the lines
-        l = []
-        z = []
-        x = []
-        y = []
-        lbefore = 0
-        # First create the list of x and y coordinates along the path
+        # First create the arrays of x and y coordinates along the path
         # Also store distance projected on map.
-         # work for each segment of polyline
-        first_segment = True
-        for p_start, p_end in zip(self.pointstoDraw[:-1],
-                                  self.pointstoDraw[1:]):
-
-            # for each polylines, set points x,y with map crs (%D) and layer crs (%C)
-            pointstoCal1 = self.tool.toLayerCoordinates(self.profiles["layer"] , QgsPointXY(*p_start))
-            pointstoCal2 = self.tool.toLayerCoordinates(self.profiles["layer"] , QgsPointXY(*p_end))
-            x1D = float(p_start[0])
-            y1D = float(p_start[1])
-            x2D = float(p_end[0])
-            y2D = float(p_end[1])
-            x1C = float(pointstoCal1.x())
-            y1C = float(pointstoCal1.y())
-            x2C = float(pointstoCal2.x())
-            y2C = float(pointstoCal2.y())
-            #lenght between (x1,y1) and (x2,y2)
-            tlC = sqrt (((x2C-x1C)*(x2C-x1C)) + ((y2C-y1C)*(y2C-y1C)))
-            #Set the res of calcul
-            try:
-                res = min(self.profiles["layer"].rasterUnitsPerPixelX(),self.profiles["layer"].rasterUnitsPerPixelY()) * tlC / max(abs(x2C-x1C), abs(y2C-y1C))    # res depend on the angle of ligne with normal
-            except ZeroDivisionError:
-                res = min(self.profiles["layer"].rasterUnitsPerPixelX(),self.profiles["layer"].rasterUnitsPerPixelY()) * 1.2
-            except AttributeError:
-                # MeshLayers have no rasterUnitsPerPixelX/Y attribute
-                res = 1
-            #enventually use bigger step, wether full res is selected or not
-            if resolution_mode == "samples":
-                """Only take values at sample points, no intermediate values."""
-                steps = 1
-            else:
-                if res != 0:
-                    """Use the map's resolution."""
-                    steps = int(tlC/res)
-                    if resolution_mode == "limited":
-                        """Hard coded limit to 1000 points per segment."""
-                        steps = min(steps, 1000)
-                else:
-                    steps = 1000
-
-            if steps < 1:
-                steps = 1
-            # calculate dx, dy and dl for one step
-            dxD = (x2D - x1D) / steps
-            dyD = (y2D - y1D) / steps
-            dlD = sqrt ((dxD*dxD) + (dyD*dyD))
-            dxC = (x2C - x1C) / steps
-            dyC = (y2C - y1C) / steps
-            #dlC = sqrt ((dxC*dxC) + (dyC*dyC))
-            # reading data
-            if first_segment:
-                debut = 0
-                first_segment = False
-            else:
-                debut = 1
-            for n in range(debut, steps + 1):
-                xC = x1C + dxC * n
-                yC = y1C + dyC * n
-                lD = dlD * n + lbefore
-                x.append(xC)
-                y.append(yC)
-                l.append(lD)
-            lbefore = l[-1]
-        # Extract the profile for the whole path
-        z = self._extractZValues(x, y)
+        # Then extract the profile for the whole path
+        x, y, l, z, zmin, zmax = self._rasterProfile(resolution_mode, interpolation)
 
         #End of polyline analysis
         #filling the main data dictionary "profiles"
         self.profiles["l"] = l
-        self.profiles["z"] = z
+        if isinstance(self.profiles["band"], tuple):
+            z = z.reshape(len(self.profiles["band"]), -1)
+            self.profiles["zbands"] = z
+            # spectral summary: mean of the bands defined at each sample
+            defined = (~np.isnan(z)).sum(axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                z = np.where(defined > 0, np.nansum(z, axis=0) / defined, np.nan)
+        # nodata and points outside the raster are None, as with identify
+        self.profiles["z"] = np.where(np.isnan(z), None, z).tolist()
         self.profiles["x"] = x
         self.profiles["y"] = y
-        self.iface.mainWindow().statusBar().showMessage("")
+        if self._readsOverviews(resolution_mode):
+            self.profiles["zmin"] = np.where(np.isnan(zmin), None, zmin).tolist()
+            self.profiles["zmax"] = np.where(np.isnan(zmax), None, zmax).tolist()
+        if self.feedback is None:
+            self.iface.mainWindow().statusBar().showMessage("")
 
         return self.profiles
 
+    def timeSeriesReaderTool(self, iface1, tool1, profile1, pointstoDraw1,
+                             resolution_mode, interpolation="nearest"):
+        """Compute the profile of every time step of the dataset group shown
+        by a mesh layer, or of every band of a raster layer read by blocks.
+
+        Return the dictionnary of dataRasterReaderTool, with also :
+            "times" : array of the time of each step, in hours from the
+                      reference time for meshes, band numbers for rasters,
+            "series" : (steps, samples) array of the values, nan where
+                       undefined,
+        or None if the layer has no series to read at once.
+        The samples are located once, their mesh triangles or raster cells
+        and interpolation weights, and reused for all the steps.
+        """
+        profile = self.dataRasterReaderTool(iface1, tool1, profile1, pointstoDraw1,
+                                            resolution_mode, interpolation)
+        layer = profile["layer"]
+        x = np.asarray(profile["x"], dtype=np.float64)
+        y = np.asarray(profile["y"], dtype=np.float64)
+        if layer.type() == layer.MeshLayer and self.meshvalues is not None:
+            series = self._meshSeries(layer, x, y)
+        elif layer.type() == layer.RasterLayer and self.sampler is not None:
+            series = self._rasterSeries(x, y, interpolation)
+        else:
+            series = None
+        if self.feedback is None:
+            self.iface.mainWindow().statusBar().showMessage("")
+        if series is None:
+            return None
+        profile["times"], profile["series"] = series
+        return profile
+
+    def swathReaderTool(self, iface1, tool1, profile1, pointstoDraw1, width,
+                        resolution_mode, interpolation="nearest", spacing=None):
+        """Compute the profile of dataRasterReaderTool, and the statistics of
+        the raster across a corridor (a swath) of width map units on both
+        sides of the polyline.
+
+        At each sample of the profile, the raster is sampled every cell
+        along the transect perpendicular to the polyline, all the transects
+        being read at once from the sampler tiles. Return the dictionnary of
+        dataRasterReaderTool, with also :
+            "swath" : {"width" : width,
+                       "min", "mean", "max" : lists of the statistics of
+                                              each transect,
+                       "p25", "p75" : lists of its percentiles, see
+                                      SWATH_PERCENTILES}
+        the statistics being None where the whole transect is undefined.
+        Layers which are not read by blocks, and multi-band profiles, get
+        no "swath".
+        """
+        profile = self.dataRasterReaderTool(iface1, tool1, profile1, pointstoDraw1,
+                                            resolution_mode, interpolation, spacing)
+        if self.sampler is None or self.sampler.multiband or len(profile["l"]) < 2:
+            return profile
+        x = np.asarray(profile["x"], dtype=np.float64)
+        y = np.asarray(profile["y"], dtype=np.float64)
+        values = self._swathValues(x, y, np.asarray(profile["l"]), width,
+                                   interpolation)
+        with warnings.catch_warnings():
+            # transects without any value give nan
+            warnings.simplefilter("ignore", RuntimeWarning)
+            statistics = {"min": np.nanmin(values, axis=1),
+                          "mean": np.nanmean(values, axis=1),
+                          "max": np.nanmax(values, axis=1)}
+            percentiles = np.nanpercentile(values, SWATH_PERCENTILES, axis=1)
+        for percentile, row in zip(SWATH_PERCENTILES, percentiles):
+            statistics["p%d" % percentile] = row
+        profile["swath"] = dict(
+            ((key, np.where(np.isnan(row), None, row).tolist())
+             for key, row in statistics.items()), width=width)
+        return profile
+
+    def _swathValues(self, x, y, l, width, interpolation):
+        """Return the (samples, transect samples) array of the raster values
+        across the swath, nan where undefined.
+
+        x, y are the profile samples in the layer crs, and l their lenghts
+        in map units, giving the local scale from map to layer units.
+        """
+        # direction of the polyline at each sample, the bisector at vertices
+        dx = np.gradient(x)
+        dy = np.gradient(y)
+        norm = np.hypot(dx, dy)
+        dl = np.gradient(l)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(dl > 0, norm / dl, 1.)
+            normalx = -dy / norm
+            normaly = dx / norm
+        halfwidth = width * scale
+        # one sample per raster cell, at most SWATH_MAX_POINTS in all
+        cell = min(self.sampler.resx, self.sampler.resy)
+        count = int(np.ceil(np.nanmedian(halfwidth) / cell)) if cell > 0 else 1
+        count = max(1, min(count, SWATH_MAX_POINTS // (2 * len(x))))
+        u = np.linspace(-1., 1., 2 * count + 1)
+        offsets = halfwidth[:, np.newaxis] * u
+        tx = x[:, np.newaxis] + normalx[:, np.newaxis] * offsets
+        ty = y[:, np.newaxis] + normaly[:, np.newaxis] * offsets
+        values = self.sampler.sample(tx.ravel(), ty.ravel(), interpolation)
+        return values.reshape(tx.shape)
+
+    def _meshSeries(self, layer, x, y):
+        return self.meshSeries(layer.dataProvider(),
+                               activeDatasetIndex(layer).group(),
+                               self.meshSampler(layer), x, y)
+
+    def meshSeries(self, provider, group, sampler, x, y):
+        """Return the times and the (steps, samples) values of the dataset
+        group of a mesh provider at x, y, see timeSeriesReaderTool, or None
+        if a step can't be read. sampler is the MeshSampler of the mesh.
+        Only provider is read, so a provider of its own (see
+        meshsampler.cloneMeshProvider) can be read outside the main thread.
+        """
+        location = sampler.locate(x, y)
+        count = provider.datasetCount(group)
+        times = np.empty(count)
+        series = np.empty((count, len(x)))
+        for i in range(count):
+            index = QgsMeshDatasetIndex(group, i)
+            values = scalarValues(provider, index)
+            if values is None:
+                return None
+            series[i] = sampler.interpolate(location, *values)
+            times[i] = provider.datasetMetadata(index).time()
+            self._status_update((100 * (i + 1)) // count)
+        return times, series
+
+    def _rasterSeries(self, x, y, interpolation):
+        count = self.provider.bandCount()
+        stencil = self.sampler.stencil(x, y, interpolation)
+        # all the bands read together, when they can share their tiles
+        sampler = createSampler(self.provider, tuple(range(1, count + 1)),
+                                self._status_update, self.sampler.maxTiles)
+        if sampler is not None:
+            return np.arange(1, count + 1, dtype=np.float64), sampler.stencilValues(stencil)
+        series = np.empty((count, len(x)))
+        for band in range(1, count + 1):
+            self._status_update((100 * band) // count)
+            sampler = createSampler(self.provider, band, maxTiles=self.sampler.maxTiles)
+            if sampler is None:
+                # band with a data type we can't read by blocks
+                series[band - 1] = np.nan
+            else:
+                series[band - 1] = sampler.stencilValues(stencil)
+        return np.arange(1, count + 1, dtype=np.float64), series
+
+    def _rasterProfile(self, resolution_mode, interpolation):
+        """Return the x, y (layer crs), l (map crs), z, zmin and zmax arrays
+        along the path.
+
+        The samples of each segment of the polyline are taken from the
+        cache when possible, and all the missing segments are sampled
+        together.
+        """
+        layer = self.profiles["layer"]
+        pointsD = np.array(self.pointstoDraw, dtype=np.float64).reshape(-1, 2)
+        if len(pointsD) < 2:
+            return tuple(np.empty(0, dtype=np.float64) for k in range(6))
+        # transform all the vertices to the layer crs in a single call
+        pointsC = self._toLayerCoordinates(layer, pointsD)
+        if resolution_mode == "cells" and self.sampler is None:
+            # no raster grid to follow
+            resolution_mode = "full"
+
+        keys = [self._segmentKey(p1, p2, resolution_mode, interpolation)
+                for p1, p2 in zip(pointsC[:-1], pointsC[1:])]
+        segments = [self.cache.get(key) if key is not None else None
+                    for key in keys]
+        missing = [i for i, segment in enumerate(segments) if segment is None]
+        lenD = np.sqrt(((pointsD[1:] - pointsD[:-1]) ** 2).sum(axis=1))
+        if missing:
+            sampled = self._sampleSegments(pointsC, missing, resolution_mode,
+                                           interpolation, lenD)
+            for i, segment in zip(missing, sampled):
+                segments[i] = segment
+                if keys[i] is not None:
+                    self.cache.put(keys[i], segment, len(segment[0]))
+
+        # join the segments: the first point of a segment is the last point
+        # of the previous one
+        lbefore = np.concatenate(([0.], np.cumsum(lenD)[:-1]))
+        start = [0] + [1] * (len(segments) - 1)
+        t, x, y, z, zmin, zmax = [
+            np.concatenate([segment[k][..., debut:] for segment, debut
+                            in zip(segments, start)], axis=-1)
+            for k in range(6)]
+        segment = np.repeat(np.arange(len(segments)),
+                            [len(s[0]) - debut for s, debut in zip(segments, start)])
+        l = lbefore[segment] + lenD[segment] * t
+        return x, y, l, z, zmin, zmax
+
+    def _segmentKey(self, p1, p2, resolution_mode, interpolation):
+        """Return the cache key of a segment's samples, or None if not cachable."""
+        if self.cache is None or self.provider is None:
+            return None
+        return (self.profiles["layer"].id(), self.profiles["band"],
+                self.provider.dataTimestamp().toMSecsSinceEpoch(),
+                tuple(p1), tuple(p2), resolution_mode, interpolation,
+                self.spacing)
+
+    def _sampleSegments(self, pointsC, indexes, resolution_mode, interpolation,
+                        lenD):
+        """Sample the segments indexes of the polyline pointsC (layer crs).
+
+        Return a list of (t, x, y, z, zmin, zmax) arrays, one per segment,
+        where t is the position of the sample on the segment (from 0 to 1)
+        and zmin, zmax the envelope of the values around each sample.
+        lenD holds the lenghts of all the segments in map units.
+        """
+        params = self._segmentParameters(pointsC, indexes, resolution_mode,
+                                         lenD)
+        if self._readsOverviews(resolution_mode):
+            return [self._sampleOverview(pointsC[i], pointsC[i + 1], t,
+                                         interpolation)
+                    for i, t in zip(indexes, params)]
+        xs = []
+        ys = []
+        xz = []
+        yz = []
+        for i, t in zip(indexes, params):
+            (x1, y1), (x2, y2) = pointsC[i], pointsC[i + 1]
+            x = x1 + (x2 - x1) * t
+            y = y1 + (y2 - y1) * t
+            xs.append(x)
+            ys.append(y)
+            if resolution_mode == "cells" and interpolation == "nearest":
+                # each sample starts a run inside one cell: read the cell
+                # between this sample and the next one, not the edge itself
+                x = np.append(0.5 * (x[:-1] + x[1:]), x[-1])
+                y = np.append(0.5 * (y[:-1] + y[1:]), y[-1])
+            xz.append(x)
+            yz.append(y)
+        z = self._extractZValues(np.concatenate(xz), np.concatenate(yz),
+                                 interpolation)
+        zs = np.split(z, np.cumsum([len(t) for t in params])[:-1], axis=-1)
+        return list(zip(params, xs, ys, zs, zs, zs))
+
+    def _readsOverviews(self, resolution_mode):
+        """Return True if the samples are read from the raster overviews,
+        with their envelope, see _sampleOverview. Multi-band profiles are
+        always read at full resolution."""
+        return (resolution_mode == "limited" and self.sampler is not None
+                and not self.sampler.multiband)
+
+    def _sampleOverview(self, p1, p2, t, interpolation):
+        """Sample segment p1-p2 (layer crs) at the positions t, from the
+        coarsest overview whose cells are no larger than the spacing.
+
+        Return (t, x, y, z, zmin, zmax), where zmin and zmax are the
+        extreme values of the overview cells crossed around each sample.
+        """
+        (x1, y1), (x2, y2) = p1, p2
+        steps = max(len(t) - 1, 1)
+        spacing = np.hypot(x2 - x1, y2 - y1) / steps
+        native = min(self.sampler.resx, self.sampler.resy)
+        level = self._overviewSampler(max(
+            [f for f in self._overviewFactors() if native * f <= spacing] or [1]))
+        x = x1 + (x2 - x1) * t
+        y = y1 + (y2 - y1) * t
+        z = level.sample(x, y, interpolation)
+        # value of each overview cell crossed, given to every sample whose
+        # half spacing neighbourhood the cell overlaps
+        crossings = level.cellCrossings(x1, y1, x2, y2)
+        middles = 0.5 * (crossings[:-1] + crossings[1:])
+        values = level.sample(x1 + (x2 - x1) * middles,
+                              y1 + (y2 - y1) * middles)
+        first = np.floor(crossings[:-1] * steps + 0.5).astype(np.int64)
+        last = np.maximum(first, np.ceil(crossings[1:] * steps - 0.5).astype(np.int64))
+        counts = last - first + 1
+        bins = (np.repeat(first - np.cumsum(counts) + counts, counts) +
+                np.arange(counts.sum()))
+        values = np.repeat(values, counts)
+        defined = ~np.isnan(values)
+        bins = bins[defined]
+        values = values[defined]
+        zmin = z.copy()
+        zmax = z.copy()
+        if len(values):
+            starts = np.concatenate(([0], np.nonzero(np.diff(bins))[0] + 1))
+            binned = bins[starts]
+            zmin[binned] = np.fmin(np.minimum.reduceat(values, starts), z[binned])
+            zmax[binned] = np.fmax(np.maximum.reduceat(values, starts), z[binned])
+        return t, x, y, z, zmin, zmax
+
+    def _overviewFactors(self):
+        if self.factors is None:
+            self.factors = overviewFactors(self.provider)
+        return self.factors
+
+    def _overviewSampler(self, factor):
+        """Return the sampler of self.sampler's band at the overview factor."""
+        if factor == 1:
+            return self.sampler
+        if factor not in self.levels:
+            self.levels[factor] = RasterBlockSampler(
+                self.provider, self.sampler.band, self._status_update,
+                self.sampler.maxTiles, factor)
+        return self.levels[factor]
+
+    def _segmentParameters(self, pointsC, indexes, resolution_mode, lenD):
+        """Return, for each segment in indexes, the positions t (from 0 to 1)
+        of its samples.
+
+        Every segment is split in steps depending on the raster resolution
+        and resolution_mode, all the segments being computed at once.
+        """
+        indexes = np.asarray(indexes)
+        p1 = pointsC[indexes]
+        p2 = pointsC[indexes + 1]
+        if resolution_mode == "cells":
+            return [self.sampler.cellCrossings(a[0], a[1], b[0], b[1])
+                    for a, b in zip(p1, p2)]
+        layer = self.profiles["layer"]
+        dx = np.abs(p2[:, 0] - p1[:, 0])
+        dy = np.abs(p2[:, 1] - p1[:, 1])
+        #lenght between (x1,y1) and (x2,y2)
+        tlC = np.sqrt(dx * dx + dy * dy)
+        #Set the res of calcul
+        try:
+            pixelsize = min(layer.rasterUnitsPerPixelX(), layer.rasterUnitsPerPixelY())
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # res depend on the angle of ligne with normal
+                res = pixelsize * tlC / np.maximum(dx, dy)
+            res[~np.isfinite(res)] = pixelsize * 1.2
+        except AttributeError:
+            # MeshLayers have no rasterUnitsPerPixelX/Y attribute
+            res = np.ones(len(tlC))
+        #enventually use bigger step, wether full res is selected or not
+        if resolution_mode == "samples":
+            # Only take values at sample points, no intermediate values.
+            steps = np.ones(len(tlC), dtype=np.int64)
+        else:
+            # Use the map's resolution.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                steps = np.where(res != 0, np.floor(tlC / np.where(res != 0, res, 1)), 1000)
+            if resolution_mode == "limited" and self.spacing:
+                # one sample every self.spacing map units
+                steps = np.minimum(steps, np.ceil(lenD[indexes] / self.spacing))
+            elif resolution_mode == "limited":
+                # Hard coded limit to 1000 points per segment.
+                steps = np.minimum(steps, 1000)
+            steps = steps.astype(np.int64)
+        steps[steps < 1] = 1
+
+        counts = steps + 1
+        firstindex = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        n = np.arange(counts.sum()) - np.repeat(firstindex, counts)
+        t = n / np.repeat(steps, counts)
+        return np.split(t, np.cumsum(counts)[:-1])
+
+    def _toLayerCoordinates(self, layer, points):
+        """Transform a (n, 2) array of map coordinates to layer coordinates."""
+        geom = QgsGeometry.fromMultiPointXY([QgsPointXY(*p) for p in points])
+        geom.transform(self._layerTransform(layer))
+        return np.array([[p.x(), p.y()] for p in geom.asMultiPoint()],
+                        dtype=np.float64)
+
+    def _layerTransform(self, layer):
+        """Return the transform from the polyline crs to the layer crs."""
+        if self.xform is not None:
+            return self.xform
+        return QgsCoordinateTransform(
+            self.tool.canvas().mapSettings().destinationCrs(),
+            layer.crs(), QgsProject.instance())
+
     def _status_update(self, advancement_pct):
-        """Send a progress message to status bar.
+        """Send a progress message to status bar, or to the feedback.
 
         advancement_pct is the advancemente in percentage (from 0 to 100).
+        Raise ProfileCanceledError if the feedback has been canceled.
         """
-        if advancement_pct % 10 == 0:
+        if self.feedback is not None:
+            if self.feedback.isCanceled():
+                raise ProfileCanceledError()
+            self.feedback.setProgress(advancement_pct)
+        elif advancement_pct % 10 == 0:
             progress = "Creating profile: " + "|" * (advancement_pct//10)
             self.iface.mainWindow().statusBar().showMessage(progress)
 
-    def _extractZValues(self, x, y):
+    def _extractZValues(self, x, y, interpolation="nearest"):
+        """Return the float array of the layer values at x, y, nan if undefined."""
         # Initialize message bar...
 
         layer = self.profiles["layer"]
@@ -161,6 +566,10 @@ class DataReaderTool:
                     attr = 0
                 z.append(attr)
                 self._status_update( (100*n) // (len(x) - 1) )
+        elif layer.type() == layer.MeshLayer and self.meshvalues is not None:
+            # locate all the points in the mesh triangles at once
+            values, onFaces, activeFaces = self.meshvalues
+            return self.meshSampler(layer).sample(x, y, values, onFaces, activeFaces)
         elif layer.type() == layer.MeshLayer:
             identifier = qgis.gui.QgsMapToolIdentify(qgis.utils.iface.mapCanvas())
             for n, coords in enumerate(zip(x, y)):
@@ -176,62 +585,81 @@ class DataReaderTool:
                     attr = 0
                 z.append(attr)
                 self._status_update( (100*n) // (len(x) - 1) )
+        elif self.sampler is not None:
+            # read the raster by blocks and sample all points at once
+            return self.sampler.sample(x, y, interpolation)
         else: #RASTER LAYERS
+            # one identify returns the values of all the bands
+            bands = choosenBand if isinstance(choosenBand, tuple) else (choosenBand,)
             for n, coords in enumerate(zip(x, y)):
                 # this code adapted from valuetool plugin
-                ident = layer.dataProvider().identify(
+                ident = self.provider.identify(
                     QgsPointXY(*coords), QgsRaster.IdentifyFormatValue )
+                results = ident.results() if ident is not None else {}
                 #if ident is not None and ident.has_key(choosenBand+1):
-                if ident is not None and (choosenBand in ident.results()):
-                    attr = ident.results()[choosenBand]
-                else:
-                    attr = 0
-                z.append(attr)
+                z.append([results[band] if band in results else 0
+                          for band in bands])
                 self._status_update( (100*n) // (len(x) - 1) )
-        return z
-
+            z = np.array(z, dtype=np.float64).reshape(-1, len(bands))
+            return z.T if isinstance(choosenBand, tuple) else z[:, 0]
+        return np.array(z, dtype=np.float64)
+
+
+    def _meshValues(self, layer):
+        """Return the values of the dataset shown by the mesh layer, at the
+        map canvas time, see meshsampler.activeScalarValues."""
+        timeRange = None
+        try:
+            canvas = qgis.utils.iface.mapCanvas()
+            if canvas.mapSettings().isTemporal():
+                timeRange = canvas.temporalRange()
+        except AttributeError:
+            # no map canvas, or QGIS < 3.14
+            pass
+        return activeScalarValues(layer, timeRange)
+
+    def meshSampler(self, layer):
+        """Return the MeshSampler of layer, kept with the cache indexes until
+        the mesh changes."""
+        key = (layer.id(), "meshsampler")
+        sampler = self.cache.getIndex(key) if self.cache is not None else None
+        if sampler is None:
+            sampler = MeshSampler.fromLayer(layer)
+            if self.cache is not None:
+                self.cache.putIndex(key, sampler)
+        return sampler
 
     def dataVectorReaderTool(self, iface1,tool1, profile1, pointstoDraw1, valbuf1):
         """
-        compute the projected points
-        return :
-            self.buffergeom : the qgsgeometry of the buffer
-            self.projectedpoints : [..., [(point caracteristics : )
-                                          #index : descripion
-                                          #0 : the pk of the projected point relative to line
-                                          #1 : the x coordinate of the projected point
-                                          #2 : the y coordinate of the projected point
-                                          #3 : the lenght between original point and projected point else -1 if interpolated
-                                          #4 : the segment of the polyline on which the point is projected
-                                          #5 : the interp value if interpfield>-1, else None
-                                          #6 : the x coordinate of the original point if the point is not interpolated, else None
-                                          #6 : the y coordinate of the original point if the point is not interpolated, else None
-                                          #6 : the feature the original point if the point is not interpolated, else None],
-                                           ...]
+        compute the projected points, a PROJECTED_POINT array
         Return a dictionnary : {"layer" : layer read,
                                 "band" : band read,
                                 "l" : array of computed lenght,
-                                "z" : array of computed z
+                                "z" : array of computed z,
+                                "x", "y" : arrays of the projected points,
+                                "buffer" : qgsgeometry of the search buffer,
+                                "projections" : qgsgeometry of the lines
+                                                from the points to their
+                                                projection}
+        The geometries are in the polyline crs.
 
 
         """
-        layercrs = profile1["layer"].crs()
-        mapcanvascrs = qgis.utils.iface.mapCanvas().mapSettings().destinationCrs()
-
         valbuffer = valbuf1
 
         projectedpoints = []
         buffergeom = None
 
-        sourceCrs = QgsCoordinateReferenceSystem( qgis.utils.iface.mapCanvas().mapSettings().destinationCrs() )
-        destCrs = QgsCoordinateReferenceSystem(profile1["layer"].crs())
-        if qgis.core.Qgis.QGIS_VERSION[0] > '2':
-            # In QGIS 3 QgsCoordinateTransform needs a QgsCoordinateTransformContext
-            xform = QgsCoordinateTransform(sourceCrs, destCrs, QgsProject.instance())
-            xformrev = QgsCoordinateTransform(destCrs, sourceCrs, QgsProject.instance())
+        if self.xform is not None:
+            xform = self.xform
         else:
-            xform = QgsCoordinateTransform(sourceCrs, destCrs)
-            xformrev = QgsCoordinateTransform(destCrs, sourceCrs)
+            sourceCrs = QgsCoordinateReferenceSystem( qgis.utils.iface.mapCanvas().mapSettings().destinationCrs() )
+            destCrs = QgsCoordinateReferenceSystem(profile1["layer"].crs())
+            if qgis.core.Qgis.QGIS_VERSION[0] > '2':
+                # In QGIS 3 QgsCoordinateTransform needs a QgsCoordinateTransformContext
+                xform = QgsCoordinateTransform(sourceCrs, destCrs, QgsProject.instance())
+            else:
+                xform = QgsCoordinateTransform(sourceCrs, destCrs)
 
         geom =  qgis.core.QgsGeometry.fromPolylineXY([QgsPointXY(point[0], point[1]) for point in pointstoDraw1])
 
@@ -239,14 +667,28 @@ class DataReaderTool:
         tempresult = geominlayercrs.transform(xform)
 
 
+        key = self._vectorKey(profile1, geominlayercrs, valbuffer)
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            return dict(cached)
+
         buffergeom = geom.buffer(valbuffer,12)
         buffergeominlayercrs = qgis.core.QgsGeometry(buffergeom)
         tempresult = buffergeominlayercrs.transform(xform)
 
 
-        featsPnt = profile1["layer"].getFeatures(QgsFeatureRequest().setFilterRect(buffergeominlayercrs.boundingBox()))
+        source = self.source or profile1["layer"]
+        index = self._pointIndex(profile1["layer"], source)
+        if index is not None:
+            projectedpoints = self._projectIndexedPoints(
+                index, source, profile1["band"], geominlayercrs, valbuffer)
+            featsPnt = []
+        else:
+            featsPnt = source.getFeatures(QgsFeatureRequest().setFilterRect(buffergeominlayercrs.boundingBox()))
 
         for featPnt in featsPnt:
+            if self.feedback is not None and self.feedback.isCanceled():
+                raise ProfileCanceledError()
             #iterate preselected point features and perform exact check with current polygon
             point3 = featPnt.geometry()
             distpoint = geominlayercrs.distance(point3)
@@ -259,20 +701,21 @@ class DataReaderTool:
                     except:
                         continue
                 else:
-                    interptemp = None
+                    interptemp = np.nan
 
                 try:
-                    projectedpoints.append([distline,
+                    projectedpoints.append((distline,
                                             pointprojected.asPoint().x(),
                                             pointprojected.asPoint().y(),
                                             distpoint, 0, interptemp,
                                             featPnt.geometry().asPoint().x(),
                                             featPnt.geometry().asPoint().y(),
-                                            featPnt])
+                                            featPnt.id()))
                 except ValueError:
-                    print
+                    #not a single point geometry (multipoint): not profiled
+                    continue
 
-        projectedpoints = np.array(projectedpoints)
+        projectedpoints = np.array(projectedpoints, dtype=PROJECTED_POINT)
 
 
         #perform postprocess computation
@@ -289,123 +732,236 @@ class DataReaderTool:
         profile={}
         profile["layer"] = profile1["layer"]
         profile["band"] = profile1["band"]
-        profile['l'] = [projectedpoint[0] for projectedpoint in projectedpoints]
-        profile['z'] = [projectedpoint[5] for projectedpoint in projectedpoints]
-        profile['x'] = [projectedpoint[1] for projectedpoint in projectedpoints]
-        profile['y'] = [projectedpoint[2] for projectedpoint in projectedpoints]
-
-        multipoly = qgis.core.QgsGeometry.fromMultiPolylineXY(
-            [[xform.transform(QgsPointXY(projectedpoint[1], projectedpoint[2]),
+        profile['l'] = projectedpoints["chainage"].tolist()
+        profile['z'] = np.where(np.isnan(projectedpoints["value"]), None,
+                                projectedpoints["value"]).tolist()
+        profile['x'] = projectedpoints["px"].tolist()
+        profile['y'] = projectedpoints["py"].tolist()
+
+        profile["buffer"] = buffergeom
+        profile["projections"] = qgis.core.QgsGeometry.fromMultiPolylineXY(
+            [[xform.transform(QgsPointXY(projectedpoint["px"], projectedpoint["py"]),
                 qgis.core.QgsCoordinateTransform.ReverseTransform) ,
-              xform.transform(QgsPointXY(projectedpoint[6], projectedpoint[7]),
+              xform.transform(QgsPointXY(projectedpoint["ox"], projectedpoint["oy"]),
                 qgis.core.QgsCoordinateTransform.ReverseTransform)]
              for projectedpoint in projectedpoints])
 
-        return profile, buffergeom, multipoly
+        if key is not None:
+            self.cache.put(key, dict(profile), len(profile['l']))
 
+        return profile
 
+    def _pointIndex(self, layer, source):
+        """Return the cached PointGridIndex of layer, built on first use.
+
+        Returns None if the layer isn't made of single points, or if it can
+        change without notice (edited layer) or the index can't be kept.
+        """
+        indexable = self.indexable
+        if indexable is None:
+            indexable = PointGridIndex.canIndex(layer)
+        if self.cache is None or not self.cachable or not indexable:
+            return None
+        key = (layer.id(), "pointindex")
+        index = self.cache.getIndex(key)
+        if index is None:
+            index = PointGridIndex.fromSource(source, self.feedback)
+            if index is None:
+                raise ProfileCanceledError()
+            self.cache.putIndex(key, index)
+        return index
+
+    def _projectIndexedPoints(self, index, source, band, geominlayercrs, valbuffer):
+        """Return the PROJECTED_POINT array of the points of index within
+        valbuffer of geominlayercrs.
+
+        Only the points of the grid cells along the polyline are tested, and
+        they are projected on all the segments at once. The features are
+        then read by id, for their attribute value.
+        """
+        polyline = np.array([[point.x(), point.y()]
+                             for point in geominlayercrs.asPolyline()])
+        candidates = index.corridor(polyline, valbuffer)
+        distline, projx, projy, distpoint, segment = projectOnPolyline(
+            index.x[candidates], index.y[candidates], polyline)
+        inside = distpoint <= valbuffer
+        candidates = candidates[inside]
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=PROJECTED_POINT)
+
+        request = QgsFeatureRequest().setFilterFids(
+            index.fids[candidates].tolist())
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        if band > -1:
+            request.setSubsetOfAttributes([band])
+        else:
+            request.setNoAttributes()
+        values = {}
+        for feature in source.getFeatures(request):
+            if self.feedback is not None and self.feedback.isCanceled():
+                raise ProfileCanceledError()
+            if band > -1:
+                try:
+                    values[feature.id()] = float(feature[band])
+                except:
+                    continue
+            else:
+                values[feature.id()] = np.nan
+
+        projectedpoints = np.zeros(len(candidates), dtype=PROJECTED_POINT)
+        projectedpoints["chainage"] = distline[inside]
+        projectedpoints["px"] = projx[inside]
+        projectedpoints["py"] = projy[inside]
+        projectedpoints["offset"] = distpoint[inside]
+        projectedpoints["segment"] = segment[inside]
+        projectedpoints["ox"] = index.x[candidates]
+        projectedpoints["oy"] = index.y[candidates]
+        projectedpoints["fid"] = index.fids[candidates]
+        projectedpoints["value"] = [values.get(fid, np.nan)
+                                    for fid in projectedpoints["fid"].tolist()]
+        # features without a valid value are skipped
+        return projectedpoints[np.isin(projectedpoints["fid"], list(values))]
+
+    def _vectorKey(self, profile, geominlayercrs, valbuffer):
+        """Return the cache key of a vector profile, or None if not cachable."""
+        if self.cache is None or not self.cachable:
+            return None
+        return (profile["layer"].id(), profile["band"],
+                tuple((p.x(), p.y()) for p in geominlayercrs.asPolyline()),
+                valbuffer)
 
 
-    def removeDuplicateLenght(self,projectedpoints):
 
-        projectedpointsfinal = []
-        duplicate = []
-        leninterp = len(projectedpoints)
+
+    def removeDuplicateLenght(self,projectedpoints):
+        """
+        Keep only the closest point (offset) of the points projected at
+        the same chainage, within PRECISION. Returns the points sorted by
+        chainage.
+
+        The points are taken in the order given, skipping those already
+        grouped: each one groups all the points closer than PRECISION in
+        chainage, grouped before or not, and the closest of the group is
+        kept, the first given on equality. Only this scan of the points is
+        a python loop, the groups are found by binary search in the sorted
+        chainages and their closest point by a single reduction.
+        """
         PRECISION = 0.01
 
-        for i in range(len(projectedpoints)):
-            pointtoinsert = None
-            if i in duplicate:
+        count = len(projectedpoints)
+        if count == 0:
+            return projectedpoints
+        lenghts = projectedpoints["chainage"]
+        order = np.argsort(lenghts, kind='stable')
+        sortedlenghts = lenghts[order]
+        position = np.empty(count, dtype=np.int64)
+        position[order] = np.arange(count)
+        #group of each point: the sorted points lo to hi - 1
+        lo = self._closerBound(sortedlenghts, sortedlenghts, PRECISION, 'right')[position]
+        hi = self._closerBound(sortedlenghts, sortedlenghts, PRECISION, 'left')[position]
+
+        grouped = bytearray(count)
+        leaders = []
+        for i, p, a, b in zip(range(count), position.tolist(),
+                              lo.tolist(), hi.tolist()):
+            if grouped[p]:
                 continue
-            else:
-                mindist = np.absolute(projectedpoints[:,0] - projectedpoints[i,0])
-                mindeltaalti = np.absolute(projectedpoints[:,5] - projectedpoints[i,5])
-                mindistindex = np.where(mindist < PRECISION)
-
-                if False:
-                    minalitindex = np.where(mindeltaalti < PRECISION )
-                    minindex = np.intersect1d(mindistindex[0],minalitindex[0])
-                    #duplicate lenght with same alti : keep only one
-                    if len(minindex) <= 1 :
-                        projectedpointsfinal.append(projectedpoints[i])
-                    else:
-                        duplicate += minindex.tolist()
-                        projectedpointsfinal.append(projectedpoints[i])
-
-                    #duplicate lenght with different alti : keep the closest
-                    mindistindex = np.setdiff1d(mindistindex[0],minindex,assume_unique=True)
-                else:
-                    #insert closest point
-                    closestindex = np.argmin(projectedpoints[mindistindex[0],3])
-                    projectedpointsfinal.append(projectedpoints[mindistindex[0][closestindex]])
-                    duplicate += mindistindex[0].tolist()
-
-        projectedpoints = np.array(projectedpointsfinal)
-        projectedpoints = projectedpoints[projectedpoints[:,0].argsort()]
+            leaders.append(i)
+            grouped[a:b] = b'\x01' * (b - a)
+
+        #closest point of each group, the first one given on equality
+        byrank = np.lexsort((np.arange(count), projectedpoints["offset"]))
+        rank = np.empty(count + 1, dtype=np.int64)
+        rank[byrank] = np.arange(count)
+        rank[count] = count
+        sortedrank = rank[np.append(order, count)]
+        leaders = np.sort(position[leaders])
+        bounds = np.stack([lo[order[leaders]], hi[order[leaders]]], axis=1).ravel()
+        closest = byrank[np.minimum.reduceat(sortedrank, bounds)[::2]]
+
+        projectedpoints = projectedpoints[closest]
+        projectedpoints = projectedpoints[projectedpoints["chainage"].argsort(kind='stable')]
         return projectedpoints
 
+    @staticmethod
+    def _closerBound(sortedlenghts, lenghts, precision, side):
+        """Return the index in sortedlenghts of the first ('right') or past
+        the last ('left') lenght closer than precision to each of lenghts,
+        with the same rounding as abs(sortedlenghts - lenght) < precision."""
+        count = len(sortedlenghts)
+        if side == 'right':
+            bound = np.searchsorted(sortedlenghts, lenghts - precision, side='right')
+        else:
+            bound = np.searchsorted(sortedlenghts, lenghts + precision, side='left')
+        #fix the rounding of lenghts -/+ precision, at the edges
+        step = -1 if side == 'right' else 1
+        while True:
+            inner = bound - (side == 'left')     # index just inside the bound
+            outer = bound - (side == 'right')    # index just outside of it
+            valid = (outer >= 0) & (outer < count)
+            grow = valid & (np.abs(sortedlenghts[np.clip(outer, 0, count - 1)]
+                                   - lenghts) < precision)
+            valid = (inner >= 0) & (inner < count)
+            shrink = valid & ~(np.abs(sortedlenghts[np.clip(inner, 0, count - 1)]
+                                      - lenghts) < precision)
+            if not grow.any() and not shrink.any():
+                return bound
+            bound[grow] += step
+            bound[shrink] -= step
+
 
     #def interpolateNodeofPolyline(self,geom):
     def interpolateNodeofPolyline(self,geom,projectedpoints):
         """
-        projectedpoints : array [[lenght, xprojected ,yprojected ,dist from origignal point, segment of polyline on witch it's projected, atribute (z), xoriginal point, yoriginal point ,original point feature], ... ]
+        projectedpoints : PROJECTED_POINT array
+        Add the polyline ends and the polyline nodes without a projected
+        point closer than PRECISION, with values interpolated between
+        their neighbours. Returns the points sorted by chainage.
         """
         PRECISION = 0.01
-        polyline = geom.asPolyline()
-        projectedpoints = projectedpoints[projectedpoints[:,0].argsort()]
-
-        lenpoly = 0
-
+        polyline = np.array([[point.x(), point.y()] for point in geom.asPolyline()])
+        #chainage of the polyline nodes
+        nodechainages = np.concatenate(
+            [[0.], np.cumsum(np.hypot(np.diff(polyline[:,0]), np.diff(polyline[:,1])))])
+        lenpoly = geom.length()
+        projectedpoints = projectedpoints[projectedpoints["chainage"].argsort()]
+        chainages = projectedpoints["chainage"]
+
+        ends = []
         #Write fist and last element if no value
-        if projectedpoints[0][0] != 0:
-            projectedpoints = np.append(projectedpoints,[[0,polyline[0].x(), polyline[0].y(), -1,0,projectedpoints[0][5],polyline[0].x(), polyline[0].y(),projectedpoints[0][8] ]], axis = 0)
-            projectedpoints = projectedpoints[projectedpoints[:,0].argsort()]
-        if projectedpoints[-1][0] != geom.length():
-            projectedpoints = np.append(projectedpoints,[[geom.length(),polyline[-1].x(), polyline[-1].y(), -1,len(polyline)-2,projectedpoints[-1][5],polyline[-1].x(), polyline[-1].y(),projectedpoints[0][8] ]], axis = 0)
-            projectedpoints = projectedpoints[projectedpoints[:,0].argsort()]
-
-        projectedpointsinterp = []
-
-        for i,point in enumerate(polyline):
-            if i == 0:
-                continue
-            elif i == len(polyline) -1 :
-                break
-            else:
-                vertexpoint_xy = QgsPointXY(geom.vertexAt(i))
-                # vertexpoint_xy = QgsPointXY(vertexpoint.x(), vertexpoint.y())
-                lenpoly = geom.lineLocatePoint(
-                    qgis.core.QgsGeometry.fromPointXY(vertexpoint_xy))
-
-                if min(abs(projectedpoints[:,0] - lenpoly)) < PRECISION :
-                    continue
-                else:
-                    temp1 = self.interpolatePoint(
-                        vertexpoint_xy, geom, projectedpoints)
-                    if temp1 != None :
-                        projectedpointsinterp.append( temp1 )
-
-
-        temp = projectedpoints.tolist() + projectedpointsinterp
-        projectedpoints = np.array(temp)
-
-        projectedpoints = projectedpoints[projectedpoints[:,0].argsort()]
+        if chainages[0] != 0:
+            ends.append((0, polyline[0,0], polyline[0,1], -1, 0,
+                         projectedpoints[0]["value"],
+                         polyline[0,0], polyline[0,1],
+                         projectedpoints[0]["fid"]))
+        if chainages[-1] != lenpoly:
+            ends.append((lenpoly, polyline[-1,0], polyline[-1,1],
+                         -1, len(polyline)-2, projectedpoints[-1]["value"],
+                         polyline[-1,0], polyline[-1,1],
+                         projectedpoints[-1]["fid"]))
+        projectedpoints = np.concatenate(
+            [projectedpoints, np.array(ends, dtype=PROJECTED_POINT)])
+        projectedpoints = projectedpoints[projectedpoints["chainage"].argsort()]
+        chainages = projectedpoints["chainage"]
+
+        #inner nodes farther than PRECISION from their closest points
+        nodes = polyline[1:-1]
+        nodechainages = nodechainages[1:-1]
+        after = np.clip(np.searchsorted(chainages, nodechainages), 1, len(chainages) - 1)
+        closest = np.minimum(np.abs(chainages[after - 1] - nodechainages),
+                             np.abs(chainages[after] - nodechainages))
+        nodes = nodes[closest >= PRECISION]
+        nodechainages = nodechainages[closest >= PRECISION]
+
+        newpoints = np.zeros(len(nodes), dtype=PROJECTED_POINT)
+        newpoints["chainage"] = nodechainages
+        newpoints["px"] = newpoints["ox"] = nodes[:,0]
+        newpoints["py"] = newpoints["oy"] = nodes[:,1]
+        newpoints["offset"] = newpoints["segment"] = newpoints["fid"] = -1
+        newpoints["value"] = np.interp(nodechainages, chainages,
+                                       projectedpoints["value"])
+
+        projectedpoints = np.concatenate([projectedpoints, newpoints])
+        projectedpoints = projectedpoints[projectedpoints["chainage"].argsort()]
 
         return projectedpoints
-
-
-    def interpolatePoint(self, vertexpoint, geom, projectedpoints):
-
-        lenpoly = geom.lineLocatePoint(qgis.core.QgsGeometry.fromPointXY(vertexpoint))
-
-        previouspointindex = np.max(np.where(projectedpoints[:,0]<=lenpoly)[0])
-        nextpointindex = np.min(np.where(projectedpoints[:,0]>=lenpoly)[0])
-
-        lentot = projectedpoints[nextpointindex][0] - projectedpoints[previouspointindex][0]
-        if lentot>0:
-            lentemp = lenpoly  - projectedpoints[previouspointindex][0]
-            z = projectedpoints[previouspointindex][5] + ( projectedpoints[nextpointindex][5] - projectedpoints[previouspointindex][5] )/ lentot * lentemp
-            #return [lenpoly, point[0], point[1], -1, None ,z,point[0], point[1], None ]
-            return [lenpoly, vertexpoint.x(), vertexpoint.y(), -1, None ,z,vertexpoint.x(), vertexpoint.y(), None ]
-        else :
-            return None
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#-----------------------------------------------------------
+#
+# Profile
+# Copyright (C) 2008  Borys Jurgiel
+# Copyright (C) 2012  Patrice Verchere
+#-----------------------------------------------------------
+#
+# licensed under the terms of GNU GPL 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, print to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#---------------------------------------------------------------------
+from qgis.core import *
+import numpy as np
+
+from math import sqrt
+
+
+class MeshSampler:
+    """Interpolate the values of a mesh layer at many points at once.
+
+    The faces of the mesh are split in triangles, fans from their first
+    vertex, which are binned in a regular grid by their bounding box, so
+    each point is only tested against the few triangles of its grid cell.
+    Values on vertices are interpolated barycentrically in the triangle
+    holding the point, as QgsMeshLayer.datasetValue does, values on faces
+    are those of the face holding the point.
+    Coordinates are in the layer CRS.
+    """
+
+    TRIANGLES_PER_CELL = 4
+    # points located at once, bounding the candidate (point, triangle) pairs
+    CHUNK = 65536
+    # barycentric tolerance, for points on the edges of the triangles
+    EPSILON = 1e-9
+
+    def __init__(self, vx, vy, faces):
+        """vx, vy : vertex coordinates, faces : lists of vertex indexes."""
+        self.vx = np.asarray(vx, dtype=np.float64)
+        self.vy = np.asarray(vy, dtype=np.float64)
+        sizes = np.array([len(face) for face in faces], dtype=np.int64)
+        self.faceCount = len(sizes)
+        flat = np.fromiter((v for face in faces for v in face), dtype=np.int64,
+                           count=sizes.sum())
+        # fan triangulation: (v0, vj, vj+1) for j in 1 .. size - 2
+        ntri = np.maximum(sizes - 2, 0)
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        self.triangleFaces = np.repeat(np.arange(len(sizes)), ntri)
+        first = np.repeat(starts, ntri)
+        j = (np.arange(ntri.sum()) -
+             np.repeat(np.concatenate(([0], np.cumsum(ntri)[:-1])), ntri) + 1)
+        self.triangles = np.stack([flat[first], flat[first + j],
+                                   flat[first + j + 1]], axis=1)
+        self._buildGrid()
+
+    def __len__(self):
+        return len(self.triangles)
+
+    @classmethod
+    def fromLayer(cls, layer):
+        """Build the sampler of the native mesh of a mesh layer."""
+        mesh = QgsMesh()
+        layer.dataProvider().populateMesh(mesh)
+        vertices = [mesh.vertex(i) for i in range(mesh.vertexCount())]
+        return cls([vertex.x() for vertex in vertices],
+                   [vertex.y() for vertex in vertices],
+                   [mesh.face(i) for i in range(mesh.faceCount())])
+
+    def _buildGrid(self):
+        tx = self.vx[self.triangles]
+        ty = self.vy[self.triangles]
+        if len(tx) > 0:
+            self.xmin, self.ymin = tx.min(), ty.min()
+            width = tx.max() - self.xmin
+            height = ty.max() - self.ymin
+        else:
+            self.xmin = self.ymin = width = height = 0.
+        area = max(width * height, width ** 2, height ** 2)
+        self.cellsize = sqrt(area * self.TRIANGLES_PER_CELL /
+                             max(len(tx), 1)) or 1.
+        self.ncols = int(width / self.cellsize) + 1
+        self.nrows = int(height / self.cellsize) + 1
+        # register each triangle in every cell of its bounding box
+        col1 = ((tx.min(axis=1) - self.xmin) / self.cellsize).astype(np.int64)
+        col2 = ((tx.max(axis=1) - self.xmin) / self.cellsize).astype(np.int64)
+        row1 = ((ty.min(axis=1) - self.ymin) / self.cellsize).astype(np.int64)
+        row2 = ((ty.max(axis=1) - self.ymin) / self.cellsize).astype(np.int64)
+        widths = col2 - col1 + 1
+        counts = widths * (row2 - row1 + 1)
+        triangles = np.repeat(np.arange(len(tx)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = ((row1[triangles] + k // widths[triangles]) * self.ncols +
+                 col1[triangles] + k % widths[triangles])
+        order = np.argsort(cells, kind='stable')
+        # self.cellTriangles[self.offsets[c]:self.offsets[c + 1]] are in cell c
+        self.cellTriangles = triangles[order]
+        self.offsets = np.searchsorted(cells[order],
+                                       np.arange(self.ncols * self.nrows + 1))
+
+    def locate(self, x, y):
+        """Return the index of the triangle holding each point x, y, -1 if
+        outside the mesh, and the (n, 3) barycentric weights of its vertices."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        found = np.full(len(x), -1, dtype=np.int64)
+        weights = np.zeros((len(x), 3))
+        for start in range(0, len(x), self.CHUNK):
+            stop = min(start + self.CHUNK, len(x))
+            found[start:stop], weights[start:stop] = self._locate(
+                x[start:stop], y[start:stop])
+        return found, weights
+
+    def _locate(self, x, y):
+        found = np.full(len(x), -1, dtype=np.int64)
+        weights = np.zeros((len(x), 3))
+        cols = np.floor((x - self.xmin) / self.cellsize)
+        rows = np.floor((y - self.ymin) / self.cellsize)
+        inside = ((cols >= 0) & (cols < self.ncols) &
+                  (rows >= 0) & (rows < self.nrows))
+        cells = (rows * self.ncols + cols)[inside].astype(np.int64)
+        points = np.nonzero(inside)[0]
+        starts = self.offsets[cells]
+        counts = self.offsets[cells + 1] - starts
+        # candidate (point, triangle) pairs
+        pairpoints = np.repeat(points, counts)
+        pairtriangles = self.cellTriangles[
+            np.repeat(starts - np.cumsum(counts) + counts, counts) +
+            np.arange(counts.sum())]
+        a, b, c = self.triangles[pairtriangles].T
+        px = x[pairpoints]
+        py = y[pairpoints]
+        det = ((self.vy[b] - self.vy[c]) * (self.vx[a] - self.vx[c]) +
+               (self.vx[c] - self.vx[b]) * (self.vy[a] - self.vy[c]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w1 = ((self.vy[b] - self.vy[c]) * (px - self.vx[c]) +
+                  (self.vx[c] - self.vx[b]) * (py - self.vy[c])) / det
+            w2 = ((self.vy[c] - self.vy[a]) * (px - self.vx[c]) +
+                  (self.vx[a] - self.vx[c]) * (py - self.vy[c])) / det
+        w3 = 1. - w1 - w2
+        hit = ((det != 0) & (w1 >= -self.EPSILON) & (w2 >= -self.EPSILON) &
+               (w3 >= -self.EPSILON))
+        # first triangle holding each point, as pairs are sorted by point
+        hitpoints, first = np.unique(pairpoints[hit], return_index=True)
+        pairs = np.nonzero(hit)[0][first]
+        found[hitpoints] = pairtriangles[pairs]
+        weights[hitpoints] = np.stack([w1[pairs], w2[pairs], w3[pairs]], axis=1)
+        return found, weights
+
+    def sample(self, x, y, values, onFaces=False, activeFaces=None):
+        """Return the float array of the values at x, y, nan outside the mesh.
+
+        values : one value per vertex, or per face if onFaces
+        activeFaces : boolean array of the faces having values, or None
+        """
+        return self.interpolate(self.locate(x, y), values, onFaces, activeFaces)
+
+    def interpolate(self, location, values, onFaces=False, activeFaces=None):
+        """Return the values at the points of location, a result of
+        locate(), to interpolate several datasets at the same points
+        without locating them again. See sample()."""
+        values = np.asarray(values, dtype=np.float64)
+        triangles, weights = location
+        z = np.full(len(triangles), np.nan)
+        ok = triangles >= 0
+        faces = self.triangleFaces[triangles[ok]]
+        if onFaces:
+            z[ok] = values[faces]
+        else:
+            z[ok] = (values[self.triangles[triangles[ok]]] * weights[ok]).sum(axis=1)
+        if activeFaces is not None:
+            z[np.nonzero(ok)[0][~activeFaces[faces]]] = np.nan
+        return z
+
+
+def cloneMeshProvider(layer):
+    """Return a new provider of the mesh and datasets of layer, to be read
+    from a single other thread as the raster provider clones are, or None
+    if it can't be created."""
+    provider = layer.dataProvider()
+    try:
+        clone = QgsProviderRegistry.instance().createProvider(
+            layer.providerType(), provider.dataSourceUri(),
+            QgsDataProvider.ProviderOptions())
+    except (AttributeError, TypeError):  # QGIS < 3.10
+        return None
+    if clone is None or not clone.isValid():
+        return None
+    for uri in provider.extraDatasets():
+        clone.addDataset(uri)
+    if clone.datasetGroupCount() != provider.datasetGroupCount():
+        return None
+    return clone
+
+
+def activeDatasetIndex(layer, timeRange=None):
+    """Return the QgsMeshDatasetIndex of the scalar dataset shown by layer,
+    at timeRange for a temporal map canvas."""
+    if timeRange is not None:
+        try:
+            index = layer.activeScalarDatasetAtTime(timeRange)
+            if index.isValid():
+                return index
+        except AttributeError:  # QGIS < 3.14
+            pass
+    try:
+        return layer.staticScalarDatasetIndex()
+    except AttributeError:  # QGIS < 3.14
+        return layer.rendererSettings().activeScalarDataset()
+
+
+def activeScalarValues(layer, timeRange=None):
+    """Return (values, onFaces, activeFaces) of the active scalar dataset
+    of layer, see MeshSampler.sample, or None if it can't be read at once
+    (no active dataset, values on edges or volumes)."""
+    index = activeDatasetIndex(layer, timeRange)
+    if index is None or not index.isValid():
+        return None
+    return scalarValues(layer.dataProvider(), index)
+
+
+def scalarValues(provider, index):
+    """Return (values, onFaces, activeFaces) of the dataset index of a mesh
+    provider, see activeScalarValues."""
+    metadata = provider.datasetGroupMetadata(index)
+    if metadata.dataType() == QgsMeshDatasetGroupMetadata.DataOnVertices:
+        onFaces = False
+        count = provider.vertexCount()
+    elif metadata.dataType() == QgsMeshDatasetGroupMetadata.DataOnFaces:
+        onFaces = True
+        count = provider.faceCount()
+    else:
+        return None
+    block = provider.datasetValues(index, 0, count)
+    if not block.isValid():
+        return None
+    values = np.array(block.values(), dtype=np.float64)
+    if not metadata.isScalar():
+        # vectors are x, y pairs: shown by their magnitude
+        values = np.hypot(values[0::2], values[1::2])
+    active = provider.areFacesActive(index, 0, provider.faceCount())
+    try:
+        activeFaces = np.array(active.active(), dtype=bool)
+    except TypeError:   # QGIS < 3.12
+        activeFaces = np.array([active.active(i)
+                                for i in range(provider.faceCount())], dtype=bool)
+    if len(activeFaces) != provider.faceCount():
+        # no active flags: all the faces are active
+        activeFaces = None
+    return values, onFaces, activeFaces
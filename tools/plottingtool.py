@@ -49,6 +49,7 @@ pg.setConfigOption('background', 'w')
 
 from .. import dxfwrite
 from ..dxfwrite import DXFEngine as dxf
+from .utils import curveKey
 
 has_qwt = False
 has_mpl = False
@@ -89,6 +90,9 @@ class PlottingTool:
     are used as the data series x and y values respectively.
     """
 
+    # transparency of the envelopes of a row, see attachCurves
+    FILL_ALPHAS = (60, 120)
+
     def changePlotWidget(self, library, frame_for_plot):
 
         if library == "PyQtGraph":
@@ -107,6 +111,11 @@ class PlottingTool:
             plotWdg.getViewBox().autoRange( items=[])
             plotWdg.getViewBox().disableAutoRange()
             plotWdg.getViewBox().border = pg.mkPen(color=(0, 0, 0),  width=1)
+            #items of the table rows, see attachCurves
+            plotWdg.profileCurves = {}
+            #cursor items, see ProfileToolCore.mouseMovedPyQtGraph
+            plotWdg.crosshair = {"vertical": datavline, "horizontal": datahline,
+                                 "xtext": xtextitem, "ytext": ytextitem}
 
             return plotWdg
 
@@ -197,26 +206,74 @@ class PlottingTool:
     def attachCurves(self, wdg, profiles, model1, library):
 
         if library == "PyQtGraph":
-            #cretae graph
+            #the items of each row are kept between the plots, keyed by
+            #layer id and band, and updated in place with setData
+            registry = wdg.plotWdg.profileCurves
+            names = []
             for i, profile in enumerate(profiles):
-                tmp_name = ("%s#%d") % (profile["layer"].name(), profile["band"])
+                tmp_name = curveKey(profile["layer"], profile["band"])
+                names.append(tmp_name)
+                entry = registry.setdefault(tmp_name, {"row": i, "curves": [], "fills": []})
+                entry["row"] = i
+                color = model1.item(i,1).data(Qt.BackgroundRole)
+                visible = bool(model1.item(i,0).data(Qt.CheckStateRole))
                 #case line outside the raster
                 y = np.array(profile["plot_y"], dtype=np.float)  #replace None value by np.nan
                 x = np.array(profile["plot_x"])
-                if model1.index(i,5).data()=='Line':
-                    wdg.plotWdg.plot(x, y, pen=pg.mkPen( model1.item(i,1).data(Qt.BackgroundRole),  width=2) , name = tmp_name)
+                #the first curve is the profile, the next ones its bands
+                bands = profile.get("plot_bands")
+                if bands is None:
+                    bands = []
+                curves = entry["curves"]
+                if not curves:
+                    if model1.index(i,5).data()=='Line':
+                        curves.append(self._plotCurve(wdg, x, y, pen=pg.mkPen(color, width=2), name = tmp_name))
+                    else:
+                        curves.append(self._plotCurve(wdg, x, y, pen=None, symbol='o', symbolSize=6, symbolPen=pg.mkPen(color, width=1), symbolBrush= pg.mkBrush(color, width=2), name = tmp_name))
                 else:
-                    wdg.plotWdg.plot(x, y, pen=None, symbol='o', symbolSize=6, symbolPen=pg.mkPen( model1.item(i,1).data(Qt.BackgroundRole),  width=1), symbolBrush= pg.mkBrush( model1.item(i,1).data(Qt.BackgroundRole),  width=2), name = tmp_name)
+                    curves[0].setData(x, y)
+                for curve, z in zip(curves[1:], bands):
+                    curve.setData(x, z, connect='finite')
+                #one thin curve per band of the multi-band rows, under their mean
+                for k in range(len(curves) - 1, len(bands)):
+                    curve = self._plotCurve(wdg, x, bands[k], pen=pg.mkPen(pg.intColor(k, hues=len(bands)), width=1),
+                                             connect='finite', name = tmp_name)
+                    curve.setZValue(-0.5)
+                    curves.append(curve)
+                while len(curves) > 1 + len(bands):
+                    wdg.plotWdg.removeItem(curves.pop())
+                #min/max of the raster between the samples or across the
+                #swath, then the quartiles of the swath, more opaque
+                envelopes = [bounds for bounds in (profile.get("plot_envelope"),
+                                                   profile.get("plot_quartiles"))
+                             if bounds is not None]
+                fills = entry["fills"]
+                while len(fills) > len(envelopes):
+                    wdg.plotWdg.removeItem(fills.pop())
+                for k, bounds in enumerate(envelopes):
+                    zmin = np.array(bounds[0], dtype=np.float64)
+                    zmax = np.array(bounds[1], dtype=np.float64)
+                    if k < len(fills):
+                        fills[k].curves[0].setData(x, zmin, connect='finite')
+                        fills[k].curves[1].setData(x, zmax, connect='finite')
+                        continue
+                    lower = pg.PlotCurveItem(x, zmin, connect='finite', name=tmp_name)
+                    upper = pg.PlotCurveItem(x, zmax, connect='finite', name=tmp_name)
+                    envelope = pg.FillBetweenItem(lower, upper, brush=self._fillColor(color, k))
+                    envelope.setZValue(-1)
+                    wdg.plotWdg.addItem(envelope)
+                    fills.append(envelope)
                 #set it visible or not
-                for item in wdg.plotWdg.getPlotItem().listDataItems():
-                    if item.name() == tmp_name:
-                        item.setVisible(model1.item(i,0).data(Qt.CheckStateRole))
-
-
+                for item in curves + fills:
+                    item.setVisible(visible)
+            #rows removed from the table
+            for tmp_name in list(registry):
+                if tmp_name not in names:
+                    self._removeRow(wdg, tmp_name)
 
         elif library == "Qwt5" and has_qwt:
             for i, profile in enumerate(profiles):
-                tmp_name = ("%s#%d") % (profile["layer"].name(), profile["band"]+1)
+                tmp_name = curveKey(profile["layer"], profile["band"])
 
                 # As QwtPlotCurve doesn't support nodata, split the data into single lines
                 # with breaks wherever data is None.
@@ -253,7 +310,7 @@ class PlottingTool:
 
         elif library == "Matplotlib" and has_mpl:
             for i, profile in enumerate(profiles):
-                tmp_name = ("%s#%d") % (profile["layer"].name(), profile["band"])
+                tmp_name = curveKey(profile["layer"], profile["band"])
                 if model1.item(i,0).data(Qt.CheckStateRole):
                     wdg.plotWdg.figure.get_axes()[0].plot(profile["plot_x"], profile["plot_y"], gid = tmp_name, linewidth = 3, visible = True)
                 else:
@@ -269,6 +326,38 @@ class PlottingTool:
             wdg.plotWdg.draw()
 
 
+    def _plotCurve(self, wdg, x, y, **kargs):
+        """Plot a profile curve with PyQtGraph. Only its part in view is
+        drawn, and lines down to about 5 samples per pixel keeping the min
+        and max of the samples of each pixel, so that panning and zooming in
+        millions of samples stay fast without hiding the spikes."""
+        curve = wdg.plotWdg.plot(x, y, **kargs)
+        curve.setClipToView(True)
+        self._setPeakDownsampling(curve, kargs.get('symbol') is None)
+        return curve
+
+    def _setPeakDownsampling(self, curve, line):
+        """Downsample curve only while drawn as a line: the symbols of
+        points would be drawn at the min and max of each pixel instead of
+        the points themselves."""
+        if line:
+            curve.setDownsampling(auto=True, method='peak')
+        else:
+            curve.setDownsampling(ds=1, auto=False)
+
+    def _fillColor(self, color, k):
+        """Return the brush color of the k-th envelope of a row of color:
+        the swath quartiles are more opaque than its envelope."""
+        color = QColor(color)
+        color.setAlpha(self.FILL_ALPHAS[k])
+        return color
+
+    def _removeRow(self, wdg, name):
+        """Remove the PyQtGraph items of the row of curve name."""
+        entry = wdg.plotWdg.profileCurves.pop(name)
+        for item in entry["curves"] + entry["fills"]:
+            wdg.plotWdg.removeItem(item)
+
     def findMin(self, values):
         minVal = min( z for z in values if z is not None )
         return minVal
@@ -296,7 +385,16 @@ class PlottingTool:
         minimumValue = wdg.sbMinVal.value()
         maximumValue = wdg.sbMaxVal.value()
 
-        y_vals = [p["plot_y"] for p in profiles]
+        y_vals = []
+        for p in profiles:
+            y_vals.append(list(p["plot_y"]))
+            if p.get("plot_bands") is not None:
+                #the band curves of the multi-band rows are drawn too
+                bands = np.asarray(p["plot_bands"], dtype=np.float64).ravel()
+                y_vals[-1] += np.where(np.isnan(bands), None, bands).tolist()
+            if p.get("plot_envelope") is not None:
+                #and the swath envelope
+                y_vals[-1] += list(p["plot_envelope"][0]) + list(p["plot_envelope"][1])
 
         if minimumValue == maximumValue:
             # Automatic mode
@@ -342,9 +440,8 @@ class PlottingTool:
             return
 
         if library == "PyQtGraph":
-            pitems = wdg.plotWdg.getPlotItem().listDataItems()
-            for item in pitems:
-                wdg.plotWdg.removeItem(item)
+            for name in list(wdg.plotWdg.profileCurves):
+                self._removeRow(wdg, name)
             try:
                 wdg.plotWdg.scene().sigMouseMoved.disconnect(self.mouseMoved)
             except:
@@ -377,15 +474,18 @@ class PlottingTool:
     def changeColor(self,wdg, library, model1, color1, name):                    #Action when clicking the tableview - color
 
         if library == "PyQtGraph":
-            pitems = wdg.plotWdg.getPlotItem()
-            for i, item in enumerate(pitems.listDataItems()):
-                if item.name() == name:
-                    if model1.item(i,5).data()=='Line':
-                        item.setPen( color1,  width=2)
-                    else:
-                        item.setPen(None)
-                        item.setSymbolPen(pg.mkPen(color1,  width=1))
-                        item.setSymbolBrush(pg.mkBrush(color1,  width=2))
+            entry = wdg.plotWdg.profileCurves.get(name)
+            if entry is not None:
+                #band curves of a multi-band row keep their colors
+                item = entry["curves"][0]
+                if model1.item(entry["row"],5).data()=='Line':
+                    item.setPen( color1,  width=2)
+                else:
+                    item.setPen(None)
+                    item.setSymbolPen(pg.mkPen(color1,  width=1))
+                    item.setSymbolBrush(pg.mkBrush(color1,  width=2))
+                for k, fill in enumerate(entry["fills"]):
+                    fill.setBrush(self._fillColor(color1, k))
 
         if library == "Qwt5":
             temp1 = wdg.plotWdg.itemList()
@@ -410,13 +510,10 @@ class PlottingTool:
     def changeAttachCurve(self, wdg, library, bool, name):                #Action when clicking the tableview - checkstate
 
         if library == "PyQtGraph":
-            pitems = wdg.plotWdg.getPlotItem()
-            for i, item in enumerate(pitems.listDataItems()):
-                if item.name() == name:
-                    if bool:
-                        item.setVisible(True)
-                    else:
-                        item.setVisible(False)
+            entry = wdg.plotWdg.profileCurves.get(name)
+            if entry is not None:
+                for item in entry["curves"] + entry["fills"]:
+                    item.setVisible(bool)
 
         elif library == "Qwt5":
             temp1 = wdg.plotWdg.itemList()
@@ -447,18 +544,20 @@ class PlottingTool:
     def changeDataPlot(self,wdg, library, model1, linetype, name):                    #Action when clicking the tableview - color
 
         if library == "PyQtGraph":
-            pitems = wdg.plotWdg.getPlotItem()
-            for i, item in enumerate(pitems.listDataItems()):
-                if item.name() == name:
-                    if linetype=='Line':
-                        item.setPen(model1.item(i,1).data(Qt.BackgroundRole),  width=2)
-                        item.setSymbol(None)
-                    else:
-                        item.setPen(None)
-                        item.setSymbol('o')
-                        item.setSymbolSize(6)
-                        item.setSymbolPen(pg.mkPen( model1.item(i,1).data(Qt.BackgroundRole),  width=1))
-                        item.setSymbolBrush(pg.mkBrush( model1.item(i,1).data(Qt.BackgroundRole),  width=2))
+            entry = wdg.plotWdg.profileCurves.get(name)
+            if entry is not None:
+                item = entry["curves"][0]
+                color = model1.item(entry["row"],1).data(Qt.BackgroundRole)
+                self._setPeakDownsampling(item, linetype=='Line')
+                if linetype=='Line':
+                    item.setPen(color,  width=2)
+                    item.setSymbol(None)
+                else:
+                    item.setPen(None)
+                    item.setSymbol('o')
+                    item.setSymbolSize(6)
+                    item.setSymbolPen(pg.mkPen( color,  width=1))
+                    item.setSymbolBrush(pg.mkBrush( color,  width=2))
 
         if library == "Qwt5":
             temp1 = wdg.plotWdg.itemList()
@@ -486,24 +585,24 @@ class PlottingTool:
         elif int(QtCore.QT_VERSION_STR[0]) == 5 :    #qgis3
             fields = [field.name() for field in layer1.fields()]'''
         if library == "PyQtGraph":
-            pitems = wdg.plotWdg.getPlotItem()
-            for i, item in enumerate(pitems.listDataItems()):
-                if item.name() == name:
-                    if plotsize=='Standard':
-                        item.setSymbolSize(6)
-                    else:
-                        if renderer.type()=='singleSymbol':
-                            size1 = renderer.symbol().size()
-                            item.setSymbolSize(size1)
-                        '''elif renderer.type()=='categorizedSymbol':
-                            filter1 = renderer.classAttribute()
-                            val = float(layer1.getFeature(i)[fields.index(filter1)])
-                            for cat in renderer.categories():
-                                size1 = cat.symbol().size()
-                                if val == cat.value():
-                                    item.setSymbolSize(size1)
-                        elif renderer.type()=='graduatedSymbol':
-                            item.setSymbolSize(6)'''
+            entry = wdg.plotWdg.profileCurves.get(name)
+            if entry is not None:
+                item = entry["curves"][0]
+                if plotsize=='Standard':
+                    item.setSymbolSize(6)
+                else:
+                    if renderer.type()=='singleSymbol':
+                        size1 = renderer.symbol().size()
+                        item.setSymbolSize(size1)
+                    '''elif renderer.type()=='categorizedSymbol':
+                        filter1 = renderer.classAttribute()
+                        val = float(layer1.getFeature(i)[fields.index(filter1)])
+                        for cat in renderer.categories():
+                            size1 = cat.symbol().size()
+                            if val == cat.value():
+                                item.setSymbolSize(size1)
+                    elif renderer.type()=='graduatedSymbol':
+                        item.setSymbolSize(6)'''
 
     def changeDataPlotColor(self,wdg, library, model1, layer1, plotsize, name):                    #Action when clicking the tableview - plot size
         renderer = layer1.renderer()
@@ -517,27 +616,27 @@ class PlottingTool:
         elif int(QtCore.QT_VERSION_STR[0]) == 5 :    #qgis3
             fields = [field.name() for field in layer1.fields()]'''
         if library == "PyQtGraph":
-            pitems = wdg.plotWdg.getPlotItem()
-            for i, item in enumerate(pitems.listDataItems()):
-                if item.name() == name:
-                    if plotsize=='Selected':
-                        item.setSymbolPen(pg.mkPen( model1.item(i,1).data(Qt.BackgroundRole),  width=1))
-                        item.setSymbolBrush(pg.mkBrush( model1.item(i,1).data(Qt.BackgroundRole),  width=2))
-                    else:
-                        if renderer.type()=='singleSymbol':
-                            color1 = renderer.symbol().color()
-                            item.setSymbolPen(pg.mkPen(color1,  width=1))
-                            item.setSymbolBrush(pg.mkBrush(color1,  width=2))
-                        '''elif renderer.type()=='categorizedSymbol':
-                            filter1 = renderer.classAttribute()
-                            val = float(a[i][fields.index(filter1)])
-                            for cat in renderer.categories():
-                                color1 = cat.symbol().color()
-                                if val == cat.value():
-                                    item.setSymbolPen(pg.mkPen(color1,  width=1))
-                                    item.setSymbolBrush(pg.mkBrush(color1,  width=2))
-                        elif renderer.type()=='graduatedSymbol':
-                            item.setSymbolSize(6)'''
+            entry = wdg.plotWdg.profileCurves.get(name)
+            if entry is not None:
+                item = entry["curves"][0]
+                if plotsize=='Selected':
+                    item.setSymbolPen(pg.mkPen( model1.item(entry["row"],1).data(Qt.BackgroundRole),  width=1))
+                    item.setSymbolBrush(pg.mkBrush( model1.item(entry["row"],1).data(Qt.BackgroundRole),  width=2))
+                else:
+                    if renderer.type()=='singleSymbol':
+                        color1 = renderer.symbol().color()
+                        item.setSymbolPen(pg.mkPen(color1,  width=1))
+                        item.setSymbolBrush(pg.mkBrush(color1,  width=2))
+                    '''elif renderer.type()=='categorizedSymbol':
+                        filter1 = renderer.classAttribute()
+                        val = float(a[i][fields.index(filter1)])
+                        for cat in renderer.categories():
+                            color1 = cat.symbol().color()
+                            if val == cat.value():
+                                item.setSymbolPen(pg.mkPen(color1,  width=1))
+                                item.setSymbolBrush(pg.mkBrush(color1,  width=2))
+                    elif renderer.type()=='graduatedSymbol':
+                        item.setSymbolSize(6)'''
 
     def manageMatplotlibAxe(self, axe1):
         axe1.grid()
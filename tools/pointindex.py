@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#-----------------------------------------------------------
+#
+# Profile
+# Copyright (C) 2008  Borys Jurgiel
+# Copyright (C) 2012  Patrice Verchere
+#-----------------------------------------------------------
+#
+# licensed under the terms of GNU GPL 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, print to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#---------------------------------------------------------------------
+from qgis.core import *
+import numpy as np
+
+from math import sqrt
+
+
+class PointGridIndex:
+    """Grid index of the coordinates of a point layer.
+
+    The points are sorted by grid cell, so the points of a cell are a
+    contiguous slice of the fids, x and y arrays. The cell size is chosen
+    to hold about POINTS_PER_CELL points on average.
+    Coordinates are in the layer CRS.
+    """
+
+    POINTS_PER_CELL = 16
+
+    def __init__(self, fids, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        fids = np.asarray(fids, dtype=np.int64)
+        if len(x) > 0:
+            self.xmin, self.ymin = x.min(), y.min()
+            width = x.max() - self.xmin
+            height = y.max() - self.ymin
+        else:
+            self.xmin = self.ymin = width = height = 0.
+        area = max(width * height, width ** 2, height ** 2)
+        self.cellsize = sqrt(area * self.POINTS_PER_CELL / max(len(x), 1)) or 1.
+        self.ncols = int(width / self.cellsize) + 1
+        self.nrows = int(height / self.cellsize) + 1
+        cells = self._cellKeys(x, y)
+        order = np.argsort(cells, kind='stable')
+        self.fids = fids[order]
+        self.x = x[order]
+        self.y = y[order]
+        # self.fids[self.offsets[c]:self.offsets[c + 1]] are the points of cell c
+        self.offsets = np.searchsorted(cells[order],
+                                       np.arange(self.ncols * self.nrows + 1))
+
+    def __len__(self):
+        return len(self.fids)
+
+    @staticmethod
+    def canIndex(layer):
+        """Returns True if layer features are single points."""
+        return (layer.geometryType() == QgsWkbTypes.PointGeometry and
+                not QgsWkbTypes.isMultiType(layer.wkbType()))
+
+    @classmethod
+    def fromSource(cls, source, feedback=None):
+        """Build the index of the points of a layer or feature source."""
+        fids = []
+        x = []
+        y = []
+        for feature in source.getFeatures(QgsFeatureRequest().setNoAttributes()):
+            if feedback is not None and feedback.isCanceled():
+                return None
+            geometry = feature.geometry()
+            if geometry.isEmpty():
+                continue
+            point = geometry.asPoint()
+            fids.append(feature.id())
+            x.append(point.x())
+            y.append(point.y())
+        return cls(fids, x, y)
+
+    def _cellKeys(self, x, y):
+        cols = ((x - self.xmin) / self.cellsize).astype(np.int64)
+        rows = ((y - self.ymin) / self.cellsize).astype(np.int64)
+        return rows * self.ncols + cols
+
+    def _cellRange(self, low, high, origin, count):
+        """Return the [first, last[ range of the cells between low and high."""
+        first = int(max(0, (low - origin) // self.cellsize))
+        last = int(min(count, (high - origin) // self.cellsize + 1))
+        return first, last
+
+    def corridor(self, polyline, distance):
+        """Return the indexes of the points which may be closer than
+        distance to polyline, a (n, 2) array of vertices."""
+        half = self.cellsize / 2.
+        candidates = []
+        for (x1, y1), (x2, y2) in zip(polyline[:-1], polyline[1:]):
+            # cells of the segment's bounding box enlarged by distance
+            col1, col2 = self._cellRange(min(x1, x2) - distance,
+                                         max(x1, x2) + distance,
+                                         self.xmin, self.ncols)
+            row1, row2 = self._cellRange(min(y1, y2) - distance,
+                                         max(y1, y2) + distance,
+                                         self.ymin, self.nrows)
+            if col1 >= col2 or row1 >= row2:
+                continue
+            rows, cols = np.mgrid[row1:row2, col1:col2]
+            rows = rows.ravel()
+            cols = cols.ravel()
+            # keep the cells whose center is close enough to the segment
+            dist, _ = _segmentDistance(self.xmin + (cols + 0.5) * self.cellsize,
+                                       self.ymin + (rows + 0.5) * self.cellsize,
+                                       x1, y1, x2, y2)
+            cells = (rows * self.ncols + cols)[dist <= distance + half * sqrt(2)]
+            starts = self.offsets[cells]
+            counts = self.offsets[cells + 1] - starts
+            if counts.sum() == 0:
+                continue
+            # expand the [start, start + count[ slices of the cells
+            candidates.append(np.repeat(starts - np.cumsum(counts) + counts,
+                                        counts) + np.arange(counts.sum()))
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(candidates))
+
+
+def _segmentDistance(px, py, x1, y1, x2, y2):
+    """Return the distances from the points px, py to segment (x1, y1)-(x2, y2),
+    and the parameters t in [0, 1] of their projections on the segment."""
+    dx = x2 - x1
+    dy = y2 - y1
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        t = np.zeros(np.shape(px))
+    else:
+        t = np.clip(((px - x1) * dx + (py - y1) * dy) / length2, 0., 1.)
+    return np.hypot(px - (x1 + t * dx), py - (y1 + t * dy)), t
+
+
+def projectOnPolyline(px, py, polyline):
+    """Project the points px, py on polyline, a (n, 2) array of vertices.
+
+    Returns the arrays of the distance along polyline of the projections,
+    their x and y, the distance of the points to polyline and the index of
+    the segment they are projected on. As with GEOS, a point equally
+    distant from several segments is projected on the first one.
+    """
+    polyline = np.asarray(polyline, dtype=np.float64)
+    lengths = np.hypot(np.diff(polyline[:, 0]), np.diff(polyline[:, 1]))
+    chainages = np.concatenate([[0.], np.cumsum(lengths)])
+    dist = np.full(len(px), np.inf)
+    t = np.zeros(len(px))
+    segment = np.zeros(len(px), dtype=np.int64)
+    for i, ((x1, y1), (x2, y2)) in enumerate(zip(polyline[:-1], polyline[1:])):
+        segdist, segt = _segmentDistance(px, py, x1, y1, x2, y2)
+        closer = segdist < dist
+        dist[closer] = segdist[closer]
+        t[closer] = segt[closer]
+        segment[closer] = i
+    start = polyline[segment]
+    end = polyline[segment + 1]
+    projx = start[:, 0] + t * (end[:, 0] - start[:, 0])
+    projy = start[:, 1] + t * (end[:, 1] - start[:, 1])
+    return chainages[segment] + t * lengths[segment], projx, projy, dist, segment
+
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#-----------------------------------------------------------
+#
+# Profile
+# Copyright (C) 2008  Borys Jurgiel
+# Copyright (C) 2012  Patrice Verchere
+#-----------------------------------------------------------
+#
+# licensed under the terms of GNU GPL 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, print to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#---------------------------------------------------------------------
+from collections import OrderedDict
+import threading
+
+
+class ProfileCache:
+    """Least recently used cache of computed profile parts.
+
+    The cache is bounded by the total number of samples of the values it
+    holds, given with each put(). It can be shared by several reader
+    threads. Keys are tuples starting with the id of the layer read.
+    The indexes of whole layers, given with putIndex(), are kept apart
+    and not bounded: they are only dropped with their layer, see
+    removeLayer.
+    """
+
+    def __init__(self, maxSamples=2000000):
+        self.maxSamples = maxSamples
+        self._entries = OrderedDict()
+        self._samples = 0
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value stored for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store value, holding size samples, for key."""
+        with self._lock:
+            if key in self._entries:
+                self._samples -= self._entries.pop(key)[1]
+            if size > self.maxSamples:
+                return
+            self._entries[key] = (value, size)
+            self._samples += size
+            while self._samples > self.maxSamples:
+                _, oldest = self._entries.popitem(last=False)
+                self._samples -= oldest[1]
+
+    def getIndex(self, key):
+        """Return the index stored for key, or None."""
+        with self._lock:
+            return self._indexes.get(key)
+
+    def putIndex(self, key, index):
+        """Store the index of a whole layer for key."""
+        with self._lock:
+            self._indexes[key] = index
+
+    def removeLayer(self, layerid):
+        """Forget every entry and index computed from layer layerid."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == layerid]:
+                self._samples -= self._entries.pop(key)[1]
+            for key in [key for key in self._indexes if key[0] == layerid]:
+                del self._indexes[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._samples = 0
+            self._indexes.clear()
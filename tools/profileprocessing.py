@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#-----------------------------------------------------------
+#
+# Profile
+# Copyright (C) 2008  Borys Jurgiel
+# Copyright (C) 2012  Patrice Verchere
+#-----------------------------------------------------------
+#
+# licensed under the terms of GNU GPL 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, print to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#---------------------------------------------------------------------
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import *
+
+from .batchprofile import BatchProfiler, profileFields, profileRows, rowsToFeatures
+from .dataReaderTool import ProfileCanceledError
+from .rastersampler import INTERPOLATIONS
+
+
+class ProfileToolProvider(QgsProcessingProvider):
+    """Processing provider of the profile tool algorithms."""
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(ExtractProfilesAlgorithm())
+
+    def id(self):
+        return "profiletool"
+
+    def name(self):
+        return "Profile tool"
+
+    def icon(self):
+        return QIcon(":/plugins/profiletool/icons/profileIcon.png")
+
+
+class ExtractProfilesAlgorithm(QgsProcessingAlgorithm):
+    """Extract the profiles of every feature of a line layer.
+
+    One point is written per profile sample, so the output can be any
+    format Processing writes to (GeoPackage, CSV, Parquet with GDAL 3.5+),
+    and the profiles are streamed to it one at a time. From the command
+    line :
+        qgis_process run profiletool:extractprofiles -- INPUT=lines.gpkg
+            LAYERS=dem.tif LAYERS=points.shp FIELD=z OUTPUT=profiles.gpkg
+    """
+
+    INPUT = "INPUT"
+    LAYERS = "LAYERS"
+    BAND = "BAND"
+    FIELD = "FIELD"
+    BUFFER = "BUFFER"
+    RESOLUTION = "RESOLUTION"
+    INTERPOLATION = "INTERPOLATION"
+    OUTPUT = "OUTPUT"
+
+    # resolution modes of DataReaderTool.dataRasterReaderTool
+    RESOLUTIONS = [("Line vertices only", "samples"),
+                   ("Limited (1000 points per segment)", "limited"),
+                   ("Full raster resolution", "full"),
+                   ("Raster cell crossings", "cells")]
+
+    def createInstance(self):
+        return ExtractProfilesAlgorithm()
+
+    def name(self):
+        return "extractprofiles"
+
+    def displayName(self):
+        return "Extract profiles along lines"
+
+    def shortHelpString(self):
+        return ("Extracts the profile of every line of the input layer from "
+                "raster layers and point layers. Writes one point per "
+                "profile sample, with its line id, line part, layer, band, "
+                "distance along the line and value.")
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT, "Lines", [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterMultipleLayers(
+            self.LAYERS, "Raster and point layers to profile",
+            QgsProcessing.TypeMapLayer))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.BAND, "Raster band", QgsProcessingParameterNumber.Integer,
+            1, minValue=1))
+        self.addParameter(QgsProcessingParameterString(
+            self.FIELD, "Value field of the point layers", optional=True))
+        self.addParameter(QgsProcessingParameterDistance(
+            self.BUFFER, "Search buffer of the point layers", 10.0,
+            self.INPUT, minValue=0.0))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.RESOLUTION, "Raster sampling",
+            [label for label, _ in self.RESOLUTIONS], defaultValue=2))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.INTERPOLATION, "Raster interpolation", INTERPOLATIONS,
+            defaultValue=0))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Profiles", QgsProcessing.TypeVectorPoint))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        """Clone the data sources of the layers, in the main thread."""
+        self.lines = self.parameterAsSource(parameters, self.INPUT, context)
+        band = self.parameterAsInt(parameters, self.BAND, context)
+        fieldname = self.parameterAsString(parameters, self.FIELD, context)
+        buffer = self.parameterAsDouble(parameters, self.BUFFER, context)
+        targets = []
+        for layer in self.parameterAsLayerList(parameters, self.LAYERS, context):
+            if layer.type() == QgsMapLayer.RasterLayer:
+                targets.append({"layer": layer, "band": band, "buffer": None})
+            elif (layer.type() == QgsMapLayer.VectorLayer and
+                  layer.geometryType() == QgsWkbTypes.PointGeometry):
+                field = layer.fields().lookupField(fieldname)
+                if field < 0:
+                    raise QgsProcessingException(
+                        "Layer %s has no field %s" % (layer.name(), fieldname))
+                targets.append({"layer": layer, "band": field, "buffer": buffer})
+            else:
+                feedback.reportError(
+                    "Layer %s is neither a raster nor a point layer, skipped"
+                    % layer.name())
+        self.profiler = BatchProfiler(
+            self.lines, self.lines.sourceCrs(), targets,
+            self.RESOLUTIONS[self.parameterAsEnum(
+                parameters, self.RESOLUTION, context)][1],
+            INTERPOLATIONS[self.parameterAsEnum(
+                parameters, self.INTERPOLATION, context)],
+            context.transformContext())
+        return True
+
+    def processAlgorithm(self, parameters, context, feedback):
+        sink, dest = self.parameterAsSink(parameters, self.OUTPUT, context,
+                                          profileFields(), QgsWkbTypes.Point,
+                                          self.lines.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(
+                self.invalidSinkError(parameters, self.OUTPUT))
+
+        feedback.canceled.connect(self.profiler.cancel)
+        total = max(self.lines.featureCount(), 1)
+        done = 0
+        lastline = None
+        try:
+            for line, part, target, profile in self.profiler.profiles():
+                if line.id() != lastline:
+                    lastline = line.id()
+                    done += 1
+                    feedback.setProgress(100. * done / total)
+                sink.addFeatures(
+                    rowsToFeatures(profileRows(line, part, target, profile)),
+                    QgsFeatureSink.FastInsert)
+        except ProfileCanceledError:
+            pass
+        finally:
+            feedback.canceled.disconnect(self.profiler.cancel)
+        return {self.OUTPUT: dest}
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#-----------------------------------------------------------
+#
+# Profile
+# Copyright (C) 2008  Borys Jurgiel
+# Copyright (C) 2012  Patrice Verchere
+#-----------------------------------------------------------
+#
+# licensed under the terms of GNU GPL 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, print to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#---------------------------------------------------------------------
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from qgis.PyQt import QtCore
+from qgis.core import *
+import numpy as np
+
+from .dataReaderTool import DataReaderTool, ProfileCanceledError
+from .meshsampler import activeDatasetIndex, cloneMeshProvider
+
+
+def computeProfile(job, iface, tool, feedback=None):
+    """Compute the profile described by job.
+
+    job is a dictionnary : {"profile" : {"layer" : layer, "band" : band},
+                            "pointstoDraw" : the polyline to compute,
+                            "buffer" : search buffer for vector layers, else None,
+                            "resolution_mode" : see dataRasterReaderTool,
+                            "interpolation" : see dataRasterReaderTool,
+                            "spacing" : see dataRasterReaderTool,
+                            "swath" : width of the swath of raster layers,
+                                      see swathReaderTool, else None,
+                            "xform" : polyline crs to layer crs transform,
+                            "source" : provider clone or feature source, or None,
+                            "cache" : ProfileCache shared by the jobs, or None,
+                            "reader" : DataReaderTool kept between jobs, which
+                                       then uses its own xform, source and cache,
+                                       or None,
+                            "threadsafe" : True if the job can run outside
+                                           the main thread,
+                            "cachable" : False if the vector layer can change
+                                         without notice (being edited), see
+                                         DataReaderTool,
+                            "indexable" : True if the points of the vector
+                                          layer can be indexed, see
+                                          DataReaderTool}
+    """
+    profile = dict(job["profile"])
+    reader = job["reader"]
+    if reader is None:
+        reader = DataReaderTool(feedback, job["xform"], job["source"], job["cache"])
+    else:
+        reader.feedback = feedback
+    reader.cachable = job["cachable"]
+    reader.indexable = job["indexable"]
+    if job["buffer"] is not None:
+        profile = reader.dataVectorReaderTool(
+            iface, tool, profile, job["pointstoDraw"], job["buffer"])
+    elif job["swath"] is not None:
+        profile = reader.swathReaderTool(
+            iface, tool, profile, job["pointstoDraw"], job["swath"],
+            job["resolution_mode"], job["interpolation"], job["spacing"])
+    else:
+        profile = reader.dataRasterReaderTool(
+            iface, tool, profile, job["pointstoDraw"],
+            job["resolution_mode"], job["interpolation"], job["spacing"])
+    # Plotting coordinate values are initialized on plotProfil
+    profile["plot_x"] = []
+    profile["plot_y"] = []
+    return profile
+
+
+def emptyProfile(job):
+    """Return the profile without samples of job, for a row which can't be
+    computed."""
+    profile = dict(job["profile"])
+    profile["l"] = []
+    profile["z"] = []
+    profile["x"] = []
+    profile["y"] = []
+    profile["plot_x"] = []
+    profile["plot_y"] = []
+    return profile
+
+
+class ProfileTask(QgsTask):
+    """Compute the profiles of the table layers in background threads.
+
+    The rows are dispatched on a pool of at most maxWorkers threads, each
+    job reading from its own provider clone or feature source. Each
+    profile is sent with profileComputed as soon as it is ready, and the
+    whole list, in table order, with allComputed once every row is done.
+    Jobs which can't run outside the main thread (mesh and plugin layers)
+    are computed in finished(), which is called in the main thread.
+    The rows whose job fails are reported in the message bar, and sent
+    with an empty profile, see emptyProfile.
+    """
+
+    profileComputed = QtCore.pyqtSignal(int, object)    # row, profile
+    allComputed = QtCore.pyqtSignal(object)             # list of profiles
+
+    def __init__(self, iface, tool, jobs, maxWorkers=None):
+        QgsTask.__init__(self, "Profile tool", QgsTask.CanCancel)
+        self.iface = iface
+        self.tool = tool
+        self.jobs = jobs
+        self.profiles = [None] * len(jobs)
+        self.errors = {}    # row: exception raised by its job
+        if maxWorkers is None:
+            maxWorkers = QtCore.QThread.idealThreadCount()
+        self.maxWorkers = max(1, maxWorkers)
+        self._threadedrows = [i for i, job in enumerate(jobs)
+                              if job["threadsafe"]]
+        # one feedback per job: progress of each row, and cancel them all
+        self.feedbacks = {}
+        for i in self._threadedrows:
+            self.feedbacks[i] = QgsFeedback()
+            self.feedbacks[i].progressChanged.connect(
+                self._feedbackProgress, QtCore.Qt.DirectConnection)
+
+    def run(self):
+        if not self._threadedrows:
+            return not self.isCanceled()
+        workers = min(self.maxWorkers, len(self._threadedrows))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(computeProfile, self.jobs[i],
+                                       self.iface, self.tool,
+                                       self.feedbacks[i]): i
+                       for i in self._threadedrows}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    self.profiles[i] = future.result()
+                except ProfileCanceledError:
+                    # stop the other rows before leaving the pool
+                    self.cancel()
+                    for future in futures:
+                        future.cancel()
+                    return False
+                except Exception as e:
+                    # the other rows go on
+                    self.errors[i] = e
+                    continue
+                self.profileComputed.emit(i, self.profiles[i])
+        return not self.isCanceled()
+
+    def cancel(self):
+        for feedback in self.feedbacks.values():
+            feedback.cancel()
+        QgsTask.cancel(self)
+
+    def finished(self, result):
+        if not result:
+            return
+        # rows which can only be read from the main thread
+        for i, job in enumerate(self.jobs):
+            if not job["threadsafe"]:
+                try:
+                    self.profiles[i] = computeProfile(job, self.iface, self.tool)
+                except Exception as e:
+                    self.errors[i] = e
+                    continue
+                self.profileComputed.emit(i, self.profiles[i])
+        if self.errors:
+            self.iface.messageBar().pushCritical(
+                "Profile tool", "The profile of %s failed: %s" % (
+                    ", ".join(self.jobs[i]["profile"]["layer"].name()
+                              for i in sorted(self.errors)),
+                    "; ".join(str(e) for e in self.errors.values())))
+            for i in self.errors:
+                self.profiles[i] = emptyProfile(self.jobs[i])
+        self.allComputed.emit(self.profiles)
+
+    def _feedbackProgress(self, progress):
+        self.setProgress(sum(feedback.progress()
+                             for feedback in self.feedbacks.values())
+                         / len(self.feedbacks))
+
+
+class TimeSeriesTask(QgsTask):
+    """Compute the profile time series of the row of job (see
+    computeProfile and DataReaderTool.timeSeriesReaderTool) in a
+    background thread.
+
+    Raster rows are read from their provider clone. The samples of mesh
+    rows are located here, in the main thread, and their time steps read
+    in the background from a provider of their own, see
+    meshsampler.cloneMeshProvider; without one, they are read in
+    finished(). seriesComputed is sent with the profile, or None if its
+    series can't be read.
+    """
+
+    seriesComputed = QtCore.pyqtSignal(object)     # profile or None
+
+    def __init__(self, iface, tool, job):
+        QgsTask.__init__(self, "Profile time series", QgsTask.CanCancel)
+        self.iface = iface
+        self.tool = tool
+        self.job = job
+        self.profile = None
+        self.exception = None
+        self.feedback = QgsFeedback()
+        self.feedback.progressChanged.connect(
+            self.setProgress, QtCore.Qt.DirectConnection)
+        self.reader = DataReaderTool(self.feedback, job["xform"], job["source"],
+                                     job["cache"])
+        self.threadsafe = job["threadsafe"]
+        self.mesh = None    # (profile, provider, group, sampler) of a mesh row
+        layer = job["profile"]["layer"]
+        if layer.type() == QgsMapLayer.MeshLayer:
+            provider = cloneMeshProvider(layer)
+            group = activeDatasetIndex(layer).group()
+            if provider is not None and 0 <= group < provider.datasetGroupCount():
+                profile = self.reader.dataRasterReaderTool(
+                    iface, tool, dict(job["profile"]), job["pointstoDraw"],
+                    job["resolution_mode"], job["interpolation"])
+                self.mesh = (profile, provider, group, self.reader.meshSampler(layer))
+                self.threadsafe = True
+
+    def run(self):
+        if not self.threadsafe:
+            return not self.isCanceled()
+        try:
+            self.profile = self._computeSeries()
+        except ProfileCanceledError:
+            return False
+        except Exception as e:
+            self.exception = e
+            return False
+        return not self.isCanceled()
+
+    def cancel(self):
+        self.feedback.cancel()
+        QgsTask.cancel(self)
+
+    def _computeSeries(self):
+        if self.mesh is None:
+            job = self.job
+            return self.reader.timeSeriesReaderTool(
+                self.iface, self.tool, dict(job["profile"]), job["pointstoDraw"],
+                job["resolution_mode"], job["interpolation"])
+        profile, provider, group, sampler = self.mesh
+        series = self.reader.meshSeries(provider, group, sampler,
+                                        np.asarray(profile["x"], dtype=np.float64),
+                                        np.asarray(profile["y"], dtype=np.float64))
+        if series is None:
+            return None
+        profile["times"], profile["series"] = series
+        return profile
+
+    def finished(self, result):
+        if self.exception is not None:
+            self.iface.messageBar().pushCritical(
+                "Profile tool", "Time series failed: %s" % self.exception)
+            return
+        if not result:
+            return
+        if not self.threadsafe:
+            # layers which can only be read from the main thread
+            try:
+                self.profile = self._computeSeries()
+            except ProfileCanceledError:
+                return
+            except Exception as e:
+                self.iface.messageBar().pushCritical(
+                    "Profile tool", "Time series failed: %s" % e)
+                return
+        self.seriesComputed.emit(self.profile)
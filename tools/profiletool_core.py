@@ -41,15 +41,23 @@ import sys
 from math import sqrt
 import numpy as np
 #plugin import
+from .profiletask import ProfileTask, TimeSeriesTask, computeProfile
 from .dataReaderTool import DataReaderTool
+from .profilecache import ProfileCache
+from .pointindex import PointGridIndex
 from .plottingtool import PlottingTool
 from .ptmaptool import ProfiletoolMapTool, ProfiletoolMapToolRenderer
 from ..ui.ptdockwidget import PTDockWidget
+from ..ui.timeseriesdialog import TimeSeriesDialog
 from . import profilers
 from .selectlinetool import SelectLineTool
+from .utils import parseBand, nearestSample
+from .. import pyqtgraph as pg
 
 class ProfileToolCore(QWidget):
 
+    PREVIEW_TILES = 16      # raster tiles kept by each reader of the previews
+
     def __init__(self, iface,plugincore, parent = None):
         QWidget.__init__(self, parent)
         self.iface = iface
@@ -69,7 +77,22 @@ class ProfileToolCore(QWidget):
         #mouse tracking
         self.doTracking = False
         #the datas / results
+        self.profileTask = None     #the background task computing self.profiles
+        self.refineJobs = None      #jobs refining the coarse profiles being computed
+        self.previewTask = None     #the task computing the live preview, until it ends
+        self.previewPoints = None   #the polyline of the preview being computed, or of the next one
+        self.previewPending = False #previewPoints waits for the running preview to end
+        self.previewReaders = {}    #readers of the previews, keeping their tiles
+        self.timeSeriesTask = None  #the task computing the time series to show
+        self.timeSeriesDialog = None
+        self.profileCache = ProfileCache()  #samples already read, by segment
         self.profiles = None        #dictionary where is saved the plotting data {"l":[l],"z":[z], "layer":layer1, "curve":curve1}
+        self.spacing = None         #samples spacing of the "limited" mode when the plot is zoomed
+        #refine the profiles once the plot zoom has settled
+        self.refineTimer = QtCore.QTimer()
+        self.refineTimer.setSingleShot(True)
+        self.refineTimer.setInterval(300)
+        self.refineTimer.timeout.connect(self.refineProfil)
         #The line information
         self.pointstoDraw = []
         #he renderer for temporary polyline
@@ -80,6 +103,7 @@ class ProfileToolCore(QWidget):
         # Used to remove highlighting from previously active layer.
         self.previousLayerId = None
         self.x_cursor = None    # Keep track of last x position of cursor
+        self.mouseProxy = None  # rate limited plot mouse moves, see enableMouseCoordonates
         #the dockwidget
         self.dockwidget = PTDockWidget(self.iface,self)
         # Initialize the dockwidget combo box with the list of available profiles.
@@ -113,6 +137,7 @@ class ProfileToolCore(QWidget):
     #******************************************************************************************
 
     def clearProfil(self):
+        self.stopPreview(True)
         self.updateProfilFromFeatures(None, [])
 
     def updateProfilFromFeatures(self, layer, features, plotProfil=True):
@@ -158,11 +183,19 @@ class ProfileToolCore(QWidget):
                     k += 1
         self.updateProfil(pointstoDraw, False, plotProfil)
 
-    def updateProfil(self, points1, removeSelection=True, plotProfil=True):
+    def updateProfil(self, points1, removeSelection=True, plotProfil=True,
+                     keepView=False):
         """Updates self.profiles from values in points1.
 
         This function can be called from updateProfilFromFeatures or from
         ProfiletoolMapToolRenderer (with a list of points from rubberband).
+        When plotProfil is True, profiles are computed by a background task
+        and plotted when it is done, else they are computed right away.
+        With PyQtGraph, long raster profiles are first computed with about
+        one sample per plot pixel, plotted, then refined in background to
+        the resolution chosen and their curves updated in place.
+        With keepView, the profiles are plotted in the current plot view
+        range, see plotProfil.
         """
         if removeSelection:
             # Be sure that we unselect anything in the previous layer.
@@ -173,38 +206,352 @@ class ProfileToolCore(QWidget):
         # replicate last point (bug #6680)
         # if points1:
         #    points1 = points1 + [points1[-1]]
+        if points1 != self.pointstoDraw:
+            # a new line is drawn unzoomed
+            self.spacing = None
         self.pointstoDraw = points1
-        self.profiles = []
-
-        #calculate profiles
+        # only the latest request is computed and rendered
+        self.cancelProfileTask()
+        self.stopPreview()
+        jobs = [self._profileJob(i)
+                for i in range(0 , self.dockwidget.mdl.rowCount())]
+
+        if not plotProfil:
+            # the caller needs the profiles right now
+            self.profiles = [computeProfile(job, self.iface, self.toolrenderer.tool)
+                             for job in jobs]
+            return
+
+        #calculate profiles in background
+        coarseJobs = self._coarseJobs(jobs)
+        if coarseJobs is None:
+            self._startProfileTask(jobs, False, keepView)
+        else:
+            self._startProfileTask(coarseJobs, False, keepView)
+            self.refineJobs = jobs
+
+    def _startProfileTask(self, jobs, inPlace, keepView=False):
+        task = ProfileTask(self.iface, self.toolrenderer.tool, jobs)
+        task.profileComputed.connect(
+            lambda row, profile, task=task: self._profileComputed(task, row, profile))
+        task.allComputed.connect(
+            lambda profiles, task=task: self._profilesComputed(task, profiles, inPlace, keepView))
+        self.profileTask = task
+        QgsApplication.taskManager().addTask(task)
+        return task
+
+    def previewProfil(self, points):
+        """Show the coarse profile of points, the polyline being drawn up to
+        the mouse cursor.
+
+        One preview is computed at a time, in its own task, beside the
+        profile of the clicked vertices, by readers kept from one preview
+        to the next so that the tiles under the cursor are only read once.
+        While it runs, only the last polyline asked for is kept, and
+        computed when it ends.
+        """
+        if (self.dockwidget.plotlibrary != "PyQtGraph" or
+                not self.dockwidget.previewCheckBox.isChecked()):
+            return
+        self.previewPoints = points
+        if self.previewTask is not None:
+            self.previewPending = True
+            return
+        self.previewPending = False
+        jobs = []
+        readers = {}
+        crs = self.iface.mapCanvas().mapSettings().destinationCrs()
         for i in range(0 , self.dockwidget.mdl.rowCount()):
-            self.profiles.append( {"layer": self.dockwidget.mdl.item(i,8).data(QtCore.Qt.EditRole) } )
-            self.profiles[i]["band"] = self.dockwidget.mdl.item(i,3).data(QtCore.Qt.EditRole)
-            #if self.dockwidget.mdl.item(i,5).data(Qt.EditRole).type() == self.dockwidget.mdl.item(i,5).data(Qt.EditRole).VectorLayer :
-            if self.dockwidget.mdl.item(i,8).data(QtCore.Qt.EditRole).type() == qgis.core.QgsMapLayer.VectorLayer :
-                self.profiles[i], _, _ = DataReaderTool().dataVectorReaderTool(self.iface, self.toolrenderer.tool, self.profiles[i], self.pointstoDraw, float(self.dockwidget.mdl.item(i,4).data(QtCore.Qt.EditRole)) )
+            layer = self.dockwidget.mdl.item(i,8).data(QtCore.Qt.EditRole)
+            key = (layer.id(), crs.authid())
+            job = self._profileJob(i, self.previewReaders.get(key), points)
+            job["spacing"] = None
+            if job["reader"] is None:
+                job["reader"] = DataReaderTool(None, job["xform"], job["source"],
+                                               job["cache"], self.PREVIEW_TILES)
+            readers[key] = job["reader"]
+            jobs.append(job)
+        self.previewReaders = readers
+        task = ProfileTask(self.iface, self.toolrenderer.tool,
+                           self._coarseJobs(jobs, points) or jobs)
+        task.allComputed.connect(
+            lambda profiles, task=task: self._previewComputed(task, profiles))
+        task.taskCompleted.connect(lambda task=task: self._previewEnded(task))
+        task.taskTerminated.connect(lambda task=task: self._previewEnded(task))
+        self.previewTask = task
+        QgsApplication.taskManager().addTask(task)
+
+    def _previewComputed(self, task, profiles):
+        # not plotted once the drawing has moved on: a newer preview is
+        # waiting, or the line was clicked or ended since
+        if (task is not self.previewTask or self.previewPending or
+                self.previewPoints is None):
+            return
+        self.profiles = profiles
+        # the view follows the polyline being drawn
+        self.plotProfil(inPlace=True, keepView=False)
+
+    def _previewEnded(self, task):
+        if task is not self.previewTask:
+            return
+        # its readers are free again
+        self.previewTask = None
+        if self.previewPending:
+            self.previewProfil(self.previewPoints)
+
+    def stopPreview(self, ended=False):
+        """Drop the preview being computed or waiting, and, once the line is
+        ended, the readers kept for the next previews and their tiles."""
+        if ended:
+            self.previewReaders = {}
+        self.previewPoints = None
+        self.previewPending = False
+        if self.previewTask is not None:
+            try:
+                self.previewTask.cancel()
+            except RuntimeError:
+                # task already deleted by the task manager
+                self.previewTask = None
+
+    def _coarseJobs(self, jobs, points=None):
+        """Return the jobs of a first profile with about one sample per plot
+        pixel, or None if jobs are not finer than that. points is the
+        polyline of the jobs of a preview, whose spacing is that of the whole
+        polyline whatever the plot zoom, else self.pointstoDraw."""
+        spacing = None
+        if points is None:
+            points = self.pointstoDraw
+            spacing = self.spacing
+        if self.dockwidget.plotlibrary != "PyQtGraph" or len(points) < 2:
+            return None
+        spacing = spacing or self._pixelSpacing(self._profileLength(points))
+        if spacing is None:
+            return None
+        coarseJobs = []
+        refine = False
+        for job in jobs:
+            if (job["resolution_mode"] in (None, "samples") or
+                    (job["resolution_mode"] == "limited" and job["spacing"] == spacing)):
+                coarseJobs.append(job)
             else:
-                if self.dockwidget.profileInterpolationCheckBox.isChecked():
-                    if self.dockwidget.fullResolutionCheckBox.isChecked():
-                        resolution_mode = "full"
-                    else:
-                        resolution_mode = "limited"
-                else:
-                    resolution_mode = "samples"
-
-                self.profiles[i] = DataReaderTool().dataRasterReaderTool(self.iface, self.toolrenderer.tool, self.profiles[i], self.pointstoDraw, resolution_mode)
-            # Plotting coordinate values are initialized on plotProfil
-            self.profiles[i]["plot_x"] = []
-            self.profiles[i]["plot_y"] = []
-
-        if plotProfil:
-            self.plotProfil()
-
-    def plotProfil(self, vertline = True):
+                # the source is shared, the coarse job is done before the other
+                coarseJobs.append(dict(job, resolution_mode="limited", spacing=spacing))
+                refine = True
+        if not refine:
+            return None
+        return coarseJobs
+
+    def _profileJob(self, i, reader=None, points=None):
+        """Return the job computing the profile of row i of the table, along
+        points, self.pointstoDraw by default.
+
+        Everything which must be read from the main thread (crs, data
+        source) is prepared here, see profiletask.computeProfile. With a
+        reader, its own xform and source are used instead.
+        """
+        if points is None:
+            points = self.pointstoDraw
+        layer = self.dockwidget.mdl.item(i,8).data(QtCore.Qt.EditRole)
+        job = {"profile": {"layer": layer,
+                           "band": parseBand(self.dockwidget.mdl.item(i,3).data(QtCore.Qt.EditRole))},
+               "pointstoDraw": list(points),
+               "buffer": None,
+               "resolution_mode": None,
+               "interpolation": None,
+               "spacing": self.spacing,
+               "swath": None,
+               "xform": None,
+               "source": None,
+               "cache": self.profileCache,
+               "reader": reader,
+               "threadsafe": False,
+               "cachable": True,
+               "indexable": False}
+        #if self.dockwidget.mdl.item(i,5).data(Qt.EditRole).type() == self.dockwidget.mdl.item(i,5).data(Qt.EditRole).VectorLayer :
+        if layer.type() == qgis.core.QgsMapLayer.VectorLayer :
+            job["buffer"] = float(self.dockwidget.mdl.item(i,4).data(QtCore.Qt.EditRole))
+            job["threadsafe"] = True
+            # features being edited are read from the edit buffer, which
+            # doesn't signal its changes to the cache
+            job["cachable"] = not layer.isEditable()
+            job["indexable"] = PointGridIndex.canIndex(layer)
+        else:
+            job["resolution_mode"] = self._resolutionMode()
+            job["interpolation"] = self.dockwidget.interpolationComboBox.currentText()
+            job["threadsafe"] = layer.type() == qgis.core.QgsMapLayer.RasterLayer
+            if job["threadsafe"]:
+                job["swath"] = self._swathWidth(i)
+        if reader is not None:
+            job["xform"] = reader.xform
+            job["source"] = reader.source
+            return job
+        job["xform"] = QgsCoordinateTransform(
+            self.iface.mapCanvas().mapSettings().destinationCrs(),
+            layer.crs(), QgsProject.instance())
+        if layer.type() == qgis.core.QgsMapLayer.VectorLayer :
+            job["source"] = QgsVectorLayerFeatureSource(layer)
+        elif layer.type() == qgis.core.QgsMapLayer.RasterLayer:
+            job["source"] = layer.dataProvider().clone()
+        return job
+
+    def showTimeSeries(self):
+        """Compute and show the profiles of all the time steps of the
+        selected row of the table, or else of the first one which has
+        several: mesh layers (time steps of the dataset group shown) and
+        multiband rasters (one step per band).
+        They are computed by a background task, and shown when it ends."""
+        mdl = self.dockwidget.mdl
+        rows = list(range(mdl.rowCount()))
+        current = self.dockwidget.tableView.currentIndex().row()
+        if current >= 0:
+            rows.insert(0, current)
+        for i in rows:
+            layer = mdl.item(i,8).data(QtCore.Qt.EditRole)
+            if (layer.type() == qgis.core.QgsMapLayer.MeshLayer or
+                    (layer.type() == qgis.core.QgsMapLayer.RasterLayer and layer.bandCount() > 1)):
+                break
+        else:
+            self.iface.messageBar().pushWarning(
+                "Profile tool", "Time series need a mesh layer or a multiband raster layer")
+            return
+        if len(self.pointstoDraw) < 2:
+            self.iface.messageBar().pushWarning("Profile tool", "Draw a profile line first")
+            return
+        if self.timeSeriesTask is not None:
+            try:
+                self.timeSeriesTask.cancel()
+            except RuntimeError:
+                # task already deleted by the task manager
+                pass
+        task = TimeSeriesTask(self.iface, self.toolrenderer.tool, self._profileJob(i))
+        task.seriesComputed.connect(
+            lambda profile, task=task: self._timeSeriesComputed(task, layer, profile))
+        self.timeSeriesTask = task
+        QgsApplication.taskManager().addTask(task)
+        self.iface.mainWindow().statusBar().showMessage(
+            "Computing the time series of %s..." % layer.name())
+
+    def _timeSeriesComputed(self, task, layer, profile):
+        if task is not self.timeSeriesTask:
+            return
+        self.timeSeriesTask = None
+        self.iface.mainWindow().statusBar().showMessage("")
+        if profile is None:
+            self.iface.messageBar().pushWarning(
+                "Profile tool", "The time steps of %s can't be read" % layer.name())
+            return
+        if self.timeSeriesDialog is not None:
+            self.timeSeriesDialog.close()
+        self.timeSeriesDialog = TimeSeriesDialog(
+            profile, layer.type() == qgis.core.QgsMapLayer.MeshLayer,
+            self.iface.mainWindow())
+        self.timeSeriesDialog.show()
+
+    def _resolutionMode(self):
+        """Return the raster resolution_mode chosen, see dataRasterReaderTool."""
+        if not self.dockwidget.profileInterpolationCheckBox.isChecked():
+            return "samples"
+        if self.dockwidget.cellCrossingCheckBox.isChecked():
+            return "cells"
+        if self.dockwidget.fullResolutionCheckBox.isChecked():
+            return "full"
+        return "limited"
+
+    def _swathWidth(self, i):
+        """Return the swath width of raster row i, see swathReaderTool, or
+        None for a single line profile."""
+        try:
+            width = float(self.dockwidget.mdl.item(i,4).data(QtCore.Qt.EditRole))
+        except (TypeError, ValueError):
+            return None
+        return width if width > 0 else None
+
+    def plotZoomed(self):
+        """Called when the plot view range changes."""
+        self.refineTimer.start()
+
+    def refineProfil(self):
+        """Recompute the "limited" profiles with one sample per plot pixel
+        of the visible part of the profile, reading the matching raster
+        overview. Back to the default samples when zoomed out."""
+        if (not self.pointstoDraw or not self.profiles or
+                self.dockwidget.plotlibrary != "PyQtGraph" or
+                self._resolutionMode() != "limited"):
+            return
+        length = self._profileLength()
+        xmin, xmax = self.dockwidget.plotWdg.getViewBox().viewRange()[0]
+        span = min(xmax, length) - max(xmin, 0)
+        if span >= length:
+            spacing = None
+        else:
+            spacing = self._pixelSpacing(span)
+        if spacing != self.spacing:
+            self.spacing = spacing
+            # the profiles of the zoomed range are shown in that range
+            self.updateProfil(self.pointstoDraw, False, keepView=True)
+
+    def _profileLength(self, points=None):
+        if points is None:
+            points = self.pointstoDraw
+        points = np.array(points, dtype=np.float64)
+        return np.sqrt(((points[1:] - points[:-1]) ** 2).sum(axis=1)).sum()
+
+    def _pixelSpacing(self, span):
+        """Return the spacing of the samples giving about one sample per
+        plot pixel on span, or None if the plot has no size yet."""
+        width = self.dockwidget.plotWdg.getViewBox().width()
+        if span <= 0 or width <= 0:
+            return None
+        # powers of 2, to get back the cached samples of a zoom level
+        return 2. ** np.floor(np.log2(span / width))
+
+    def cancelProfileTask(self):
+        self.refineJobs = None
+        if self.profileTask is not None:
+            try:
+                self.profileTask.cancel()
+            except RuntimeError:
+                # task already deleted by the task manager
+                pass
+            self.profileTask = None
+
+    def _profileComputed(self, task, row, profile):
+        if task is not self.profileTask:
+            return
+        self.iface.mainWindow().statusBar().showMessage(
+            "Profile of %s computed" % profile["layer"].name())
+
+    def _profilesComputed(self, task, profiles, inPlace, keepView=False):
+        if task is not self.profileTask:
+            return
+        self.profileTask = None
+        self.profiles = profiles
+        if self.refineJobs is not None:
+            # coarse profiles: plot them, then refine them
+            jobs = self.refineJobs
+            self.refineJobs = None
+            self.plotProfil(keepView=keepView)
+            self.iface.mainWindow().statusBar().showMessage("Refining profiles...")
+            self._startProfileTask(jobs, True)
+            return
+        self.iface.mainWindow().statusBar().showMessage("")
+        self.plotProfil(inPlace=inPlace, keepView=inPlace or keepView)
+
+    def plotProfil(self, vertline = True, inPlace = False, keepView = None):
+        """Plot self.profiles. With inPlace, the curves already plotted are
+        updated with the refined profiles instead of being plotted again.
+        With keepView, by default with inPlace, the plot view range is left
+        as the user zoomed or panned it, else fitted to the profiles."""
+        if keepView is None:
+            keepView = inPlace
         self.disableMouseCoordonates()
 
         self.removeClosedLayers(self.dockwidget.mdl)
-        PlottingTool().clearData(self.dockwidget, self.profiles, self.dockwidget.plotlibrary)
+        if inPlace:
+            vertline = False
+        elif self.dockwidget.plotlibrary != "PyQtGraph":
+            # PyQtGraph curves are kept and updated, see attachCurves
+            PlottingTool().clearData(self.dockwidget, self.profiles, self.dockwidget.plotlibrary)
 
         # if not self.pointstoDraw:
         #    self.updateCursorOnMap(self.x_cursor)
@@ -213,14 +560,12 @@ class ProfileToolCore(QWidget):
         if vertline:                        #Plotting vertical lines at the node of polyline draw
             PlottingTool().drawVertLine(self.dockwidget, self.pointstoDraw, self.dockwidget.plotlibrary)
 
-        #calculate buffer geometries if search buffer is set in mdt layer
+        #buffer geometries of the vector layers, computed with their profile
         geoms = []
-        for i in range(0 , self.dockwidget.mdl.rowCount()):
-            #if self.dockwidget.mdl.item(i,5).data(Qt.EditRole).type() == self.dockwidget.mdl.item(i,5).data(Qt.EditRole).VectorLayer :
-            if self.dockwidget.mdl.item(i,8).data(QtCore.Qt.EditRole).type() == qgis.core.QgsMapLayer.VectorLayer :
-                _, buffer, multipoly = DataReaderTool().dataVectorReaderTool(self.iface, self.toolrenderer.tool, self.profiles[i], self.pointstoDraw, float(self.dockwidget.mdl.item(i,4).data(QtCore.Qt.EditRole)) )
-                geoms.append(buffer)
-                geoms.append(multipoly)
+        for profile in self.profiles:
+            if profile.get("buffer") is not None:
+                geoms.append(profile["buffer"])
+                geoms.append(profile["projections"])
         self.toolrenderer.setBufferGeometry(geoms)
 
         # Update coordinates to use in plot (height, slope %...)
@@ -229,17 +574,33 @@ class ProfileToolCore(QWidget):
 
         for profile in self.profiles:
             profile["plot_x"], profile["plot_y"] = profile_func(profile)
+            # envelope of the values across the swath or between the
+            # samples, and quartiles of the swath, for heights only
+            profile["plot_envelope"] = None
+            profile["plot_quartiles"] = None
+            if profile_func is profilers.height and "swath" in profile:
+                swath = profile["swath"]
+                profile["plot_envelope"] = (swath["min"], swath["max"])
+                profile["plot_quartiles"] = (swath["p25"], swath["p75"])
+            elif profile_func is profilers.height and "zmin" in profile:
+                profile["plot_envelope"] = (profile["zmin"], profile["zmax"])
+            # values of each band of the multi-band rows, for heights only
+            if profile_func is profilers.height and "zbands" in profile:
+                profile["plot_bands"] = profile["zbands"]
+            else:
+                profile["plot_bands"] = None
 
         #plot profiles
         PlottingTool().attachCurves(self.dockwidget, self.profiles, self.dockwidget.mdl, self.dockwidget.plotlibrary)
-        PlottingTool().reScalePlot(self.dockwidget, self.profiles, self.dockwidget.plotlibrary)
+        if not keepView:
+            PlottingTool().reScalePlot(self.dockwidget, self.profiles, self.dockwidget.plotlibrary)
         #create tab with profile xy
         self.dockwidget.updateCoordinateTab()
         #Mouse tracking
 
 
         self.updateCursorOnMap(self.x_cursor)
-        self.enableMouseCoordonates(self.dockwidget.plotlibrary)
+        self.enableMouseCoordonates(self.dockwidget.plotlibrary, not keepView)
 
     def updateCursorOnMap(self, x):
         self.x_cursor = x
@@ -287,6 +648,7 @@ class ProfileToolCore(QWidget):
                 break
 
     def cleaning(self):
+        self.cancelProfileTask()
         self.clearProfil()
         if self.toolrenderer:
             self.toolrenderer.cleaning()
@@ -357,26 +719,30 @@ class ProfileToolCore(QWidget):
             self.updateCursorOnMap(xdata)
 
 
-    def enableMouseCoordonates(self,library):
+    def enableMouseCoordonates(self,library, autoRange=True):
         if library == "PyQtGraph":
-            self.dockwidget.plotWdg.scene().sigMouseMoved.connect(self.mouseMovedPyQtGraph)
-            self.dockwidget.plotWdg.getViewBox().autoRange( items=self.dockwidget.plotWdg.getPlotItem().listDataItems())
+            self.disableMouseCoordonates()
+            #at most one cursor update per frame, whatever the mouse event rate
+            self.mouseProxy = pg.SignalProxy(self.dockwidget.plotWdg.scene().sigMouseMoved,
+                                             rateLimit=60, slot=self.mouseMovedPyQtGraph)
+            if autoRange:
+                self.dockwidget.plotWdg.getViewBox().autoRange( items=self.dockwidget.plotWdg.getPlotItem().listDataItems())
             #self.dockwidget.plotWdg.getViewBox().sigRangeChanged.connect(self.dockwidget.plotRangechanged)
             self.dockwidget.connectPlotRangechanged()
 
 
 
     def disableMouseCoordonates(self):
-        try:
-            self.dockwidget.plotWdg.scene().sigMouseMoved.disconnect(self.mouseMovedPyQtGraph)
-        except:
-            pass
+        if self.mouseProxy is not None:
+            self.mouseProxy.disconnect()
+            self.mouseProxy = None
 
         self.dockwidget.disconnectPlotRangechanged()
 
 
 
-    def mouseMovedPyQtGraph(self, pos): # si connexion directe du signal "mouseMoved" : la fonction reçoit le point courant
+    def mouseMovedPyQtGraph(self, args): # arguments of the "sigMouseMoved" signal, forwarded by mouseProxy
+            pos = args[0]
             roundvalue = 3
 
             if self.dockwidget.plotWdg.sceneBoundingRect().contains(pos): # si le point est dans la zone courante
@@ -385,48 +751,36 @@ class ProfileToolCore(QWidget):
                     range = self.dockwidget.plotWdg.getViewBox().viewRange()
                     mousePoint = self.dockwidget.plotWdg.getViewBox().mapSceneToView(pos) # récupère le point souris à partir ViewBox
 
-                    datas = []
                     pitems = self.dockwidget.plotWdg.getPlotItem()
                     ytoplot = None
                     xtoplot = None
 
-                    if len(pitems.listDataItems())>0:
-                        #get data and nearest xy from cursor
-                        compt = 0
-                        try:
-                            for  item in pitems.listDataItems():
-                                if item.isVisible() :
-                                    x,y = item.getData()
-                                    nearestindex = np.argmin( abs(np.array(x)-mousePoint.x()) )
-                                    if compt == 0:
-                                        xtoplot = np.array(x)[nearestindex]
-                                        ytoplot = np.array(y)[nearestindex]
-                                    else:
-                                        if abs( np.array(y)[nearestindex] - mousePoint.y() ) < abs( ytoplot -  mousePoint.y() ):
-                                            ytoplot = np.array(y)[nearestindex]
-                                            xtoplot = np.array(x)[nearestindex]
-                                    compt += 1
-                        except ValueError:
-                            ytoplot = None
-                            xtoplot = None
-                        #plot xy label and cursor
-                        if not xtoplot is None and not ytoplot is None:
-                            for item in self.dockwidget.plotWdg.allChildItems():
-                                if str(type(item)) == "<class 'profiletool.pyqtgraph.graphicsItems.InfiniteLine.InfiniteLine'>":
-                                    if item.name() == 'cross_vertical':
-                                        item.show()
-                                        item.setPos(xtoplot)
-                                    elif item.name() == 'cross_horizontal':
-                                        item.show()
-                                        item.setPos(ytoplot)
-                                elif str(type(item)) == "<class 'profiletool.pyqtgraph.graphicsItems.TextItem.TextItem'>":
-                                    if item.textItem.toPlainText()[0] == 'X':
-                                        item.show()
-                                        item.setText('X : '+str(round(xtoplot,roundvalue)))
-                                        item.setPos(xtoplot,range[1][0] )
-                                    elif item.textItem.toPlainText()[0] == 'Y':
-                                        item.show()
-                                        item.setText('Y : '+str(round(ytoplot,roundvalue)))
-                                        item.setPos(range[0][0],ytoplot )
+                    #get data and nearest xy from cursor: the sample of each
+                    #curve nearest in x, binary searched, then the curve
+                    #nearest in y
+                    for item in pitems.listDataItems():
+                        if item.isVisible() :
+                            nearestindex = nearestSample(item, mousePoint.x())
+                            if nearestindex is None:
+                                continue
+                            y = item.yData[nearestindex]
+                            if np.isnan(y):
+                                continue
+                            if ytoplot is None or abs(y - mousePoint.y()) < abs(ytoplot - mousePoint.y()):
+                                ytoplot = y
+                                xtoplot = item.xData[nearestindex]
+                    #plot xy label and cursor
+                    if not xtoplot is None and not ytoplot is None:
+                        crosshair = self.dockwidget.plotWdg.crosshair
+                        crosshair["vertical"].show()
+                        crosshair["vertical"].setPos(xtoplot)
+                        crosshair["horizontal"].show()
+                        crosshair["horizontal"].setPos(ytoplot)
+                        crosshair["xtext"].show()
+                        crosshair["xtext"].setText('X : '+str(round(xtoplot,roundvalue)))
+                        crosshair["xtext"].setPos(xtoplot,range[1][0] )
+                        crosshair["ytext"].show()
+                        crosshair["ytext"].setText('Y : '+str(round(ytoplot,roundvalue)))
+                        crosshair["ytext"].setPos(range[0][0],ytoplot )
                     #tracking part
                     self.updateCursorOnMap(xtoplot)
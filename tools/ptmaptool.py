@@ -35,6 +35,7 @@ from qgis.gui import *
 import qgis
 
 from .selectlinetool import SelectLineTool
+from .. import pyqtgraph as pg
 
 
 
@@ -47,6 +48,7 @@ class ProfiletoolMapToolRenderer():
         self.tool = ProfiletoolMapTool(self.canvas,self.profiletool.plugincore.action)        #the mouselistener
         self.pointstoDraw = []  #Polyline being drawn in freehand mode
         self.dblclktemp = None        #enable disctinction between leftclick and doubleclick
+        self.previewProxy = None        #rate limits the live preview to the last mouse position
         #the rubberband
         self.polygon = False
         self.rubberband = QgsRubberBand(self.iface.mapCanvas(), self.polygon)
@@ -94,6 +96,12 @@ class ProfiletoolMapToolRenderer():
         if self.selectionmethod in (1, 2):
             return
 
+    def previewMoved(self, args):        #preview the profile of the polyline ending at the mouse
+        position = args[0]
+        if self.selectionmethod == 0 and len(self.pointstoDraw) > 0:
+            mapPos = self.canvas.getCoordinateTransform().toMapCoordinates(position["x"],position["y"])
+            self.profiletool.previewProfil(self.pointstoDraw + [[mapPos.x(), mapPos.y()]])
+
     def rightClicked(self,position):    #used to quit the current action
         self.profiletool.clearProfil()
         self.cleaning()
@@ -137,6 +145,7 @@ class ProfiletoolMapToolRenderer():
             #launch analyses
             self.iface.mainWindow().statusBar().showMessage(str(self.pointstoDraw))
             self.profiletool.updateProfil(self.pointstoDraw)
+            self.profiletool.stopPreview(True)
             #Reset
             self.pointstoDraw = []
             #temp point to distinct leftclick and dbleclick
@@ -185,6 +194,7 @@ class ProfiletoolMapToolRenderer():
         self.tool.leftClicked.connect(self.leftClicked)
         self.tool.doubleClicked.connect(self.doubleClicked)
         self.tool.desactivate.connect(self.deactivate)
+        self.previewProxy = pg.SignalProxy(self.tool.moved, rateLimit=10, slot=self.previewMoved)
         self.iface.currentLayerChanged.connect(
             self.currentLayerChanged)
 
@@ -195,6 +205,8 @@ class ProfiletoolMapToolRenderer():
         self.tool.leftClicked.disconnect(self.leftClicked)
         self.tool.doubleClicked.disconnect(self.doubleClicked)
         self.tool.desactivate.disconnect(self.deactivate)
+        self.previewProxy.disconnect()
+        self.previewProxy = None
         self.iface.currentLayerChanged.disconnect(
             self.currentLayerChanged)
         self.canvas.unsetMapTool(self.tool)
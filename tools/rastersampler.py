@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+#-----------------------------------------------------------
+#
+# Profile
+# Copyright (C) 2008  Borys Jurgiel
+# Copyright (C) 2012  Patrice Verchere
+#-----------------------------------------------------------
+#
+# licensed under the terms of GNU GPL 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, print to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#---------------------------------------------------------------------
+from collections import OrderedDict
+import os
+
+from qgis.core import *
+import numpy as np
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+
+# numpy equivalents of the QgsRasterBlock data types we know how to read
+DATA_TYPES = {Qgis.Byte: np.uint8,
+              Qgis.UInt16: np.uint16,
+              Qgis.Int16: np.int16,
+              Qgis.UInt32: np.uint32,
+              Qgis.Int32: np.int32,
+              Qgis.Float32: np.float32,
+              Qgis.Float64: np.float64}
+
+
+# interpolation modes supported by RasterBlockSampler.sample
+INTERPOLATIONS = ["nearest", "bilinear", "bicubic"]
+
+
+def _cubicWeights(f, a=-0.5):
+    """Return the 4 weights of the cubic convolution kernel (Keys, a=-0.5)
+    for the cells at offsets -1, 0, 1, 2 of a fractional position f."""
+    d = (1 + f, f, 1 - f, 2 - f)
+    weights = []
+    for t in d:
+        weights.append(np.where(
+            t <= 1,
+            (a + 2) * t ** 3 - (a + 3) * t ** 2 + 1,
+            a * t ** 3 - 5 * a * t ** 2 + 8 * a * t - 4 * a))
+    return weights
+
+
+class RasterBlockSampler:
+    """Sample one band of a raster provider at many positions.
+
+    Instead of one identify() call per position, the bounding window of
+    the positions is split in tiles aligned on the raster grid. Each tile
+    holding at least one position is read with a single block() call and
+    converted to a numpy array, then all positions are looked up with
+    vectorized index math.
+    Positions are expected in the layer CRS. Values are returned as a
+    float64 array where nodata and positions outside the raster are nan.
+    Tiles are kept for the next calls. With maxTiles, only the maxTiles
+    most recently used are kept.
+    With a factor > 1, the sampler reads a grid factor times coarser than
+    the raster: the provider then reads its blocks from the matching
+    overview, if the raster has one (see overviewFactors).
+    band may also be a tuple of bands, read together tile by tile: values
+    are then returned as (bands, positions) arrays.
+    """
+
+    TILE_SIZE = 512
+
+    def __init__(self, provider, band, progress=None, maxTiles=None, factor=1):
+        self.provider = provider
+        self.band = band
+        self.bands = tuple(band) if isinstance(band, (tuple, list)) else (band,)
+        self.progress = progress    # callable receiving a percentage
+        self.maxTiles = maxTiles
+        self.factor = factor
+        self.tileWidth = self.tileHeight = self.TILE_SIZE
+        self.nodata = None          # nodata value left in the tiles, if any
+        extent = provider.extent()
+        self.ncols = max(1, int(round(provider.xSize() / factor)))
+        self.nrows = max(1, int(round(provider.ySize() / factor)))
+        self.xmin = extent.xMinimum()
+        self.ymax = extent.yMaximum()
+        self.resx = extent.width() / self.ncols
+        self.resy = extent.height() / self.nrows
+        self._tiles = OrderedDict()
+
+    @staticmethod
+    def canSample(provider):
+        """Returns True if provider has a fixed grid we can read blocks from."""
+        return (provider is not None and
+                bool(provider.capabilities() & QgsRasterDataProvider.Size) and
+                provider.xSize() > 0 and provider.ySize() > 0 and
+                provider.dataType(1) in DATA_TYPES)
+
+    def cellIndex(self, x, y):
+        """Return the (row, col) integer arrays of the cells holding x, y."""
+        cols = np.floor((np.asarray(x, dtype=np.float64) - self.xmin) / self.resx)
+        rows = np.floor((self.ymax - np.asarray(y, dtype=np.float64)) / self.resy)
+        return rows.astype(np.int64), cols.astype(np.int64)
+
+    def sample(self, x, y, interpolation="nearest"):
+        """Return the raster values at each x, y position.
+
+        interpolation is one of INTERPOLATIONS. Where bilinear or bicubic
+        interpolation needs an undefined neighbour cell (nodata or outside
+        the raster), the nearest cell value is used.
+        """
+        return self.stencilValues(self.stencil(x, y, interpolation))
+
+    def stencil(self, x, y, interpolation="nearest"):
+        """Return the (rows, cols, weights) arrays, of shape (k, n), of the
+        cells read to interpolate each x, y position: the nearest cell
+        first, then the cells weighted by interpolation.
+
+        Give it to stencilValues of the samplers of other bands of the same
+        raster to sample them at the same positions without locating the
+        positions again.
+        """
+        rows, cols = self.cellIndex(x, y)
+        if interpolation == "nearest" or len(rows) == 0:
+            return rows[None], cols[None], np.ones((1, len(rows)))
+        # fractional position relative to the cell centers
+        u = (np.asarray(x, dtype=np.float64) - self.xmin) / self.resx - 0.5
+        v = (self.ymax - np.asarray(y, dtype=np.float64)) / self.resy - 0.5
+        col0 = np.floor(u).astype(np.int64)
+        row0 = np.floor(v).astype(np.int64)
+        fu = u - col0
+        fv = v - row0
+        if interpolation == "bilinear":
+            offsets = (0, 1)
+            wu = (1 - fu, fu)
+            wv = (1 - fv, fv)
+        elif interpolation == "bicubic":
+            offsets = (-1, 0, 1, 2)
+            wu = _cubicWeights(fu)
+            wv = _cubicWeights(fv)
+        else:
+            raise ValueError("Unknown interpolation: %s" % interpolation)
+        allrows = [rows]
+        allcols = [cols]
+        weights = [np.zeros(len(rows))]
+        for i, drow in enumerate(offsets):
+            for j, dcol in enumerate(offsets):
+                allrows.append(row0 + drow)
+                allcols.append(col0 + dcol)
+                weights.append(wv[i] * wu[j])
+        return np.array(allrows), np.array(allcols), np.array(weights)
+
+    def stencilValues(self, stencil):
+        """Return the values interpolated with stencil, see stencil(). All
+        its cells are read at once."""
+        rows, cols, weights = stencil
+        values = self.cellValues(rows.ravel(), cols.ravel())
+        # (stencil cells, positions), after the bands axis if any
+        values = values.reshape(values.shape[:-1] + rows.shape)
+        if len(rows) == 1:
+            return values[..., 0, :]
+        interpolated = (values[..., 1:, :] * weights[1:]).sum(axis=-2)
+        return np.where(np.isnan(interpolated), values[..., 0, :], interpolated)
+
+    def cellCrossings(self, x1, y1, x2, y2):
+        """Return the positions where segment (x1, y1)-(x2, y2) crosses cells.
+
+        The result is the sorted array of the segment parameters t (0 at
+        x1, y1 and 1 at x2, y2) of the segment ends and of every column or
+        row edge of the raster grid crossed by the segment. This is the
+        Amanatides-Woo grid traversal, computed for all the edges at once.
+        """
+        params = [np.array([0., 1.])]
+        for a1, a2, origin, res in ((x1, x2, self.xmin, self.resx),
+                                    (y1, y2, self.ymax, -self.resy)):
+            if a1 == a2:
+                continue
+            k1 = (a1 - origin) / res
+            k2 = (a2 - origin) / res
+            edges = np.arange(np.floor(min(k1, k2)) + 1, np.ceil(max(k1, k2)))
+            params.append((edges - k1) / (k2 - k1))
+        return np.unique(np.concatenate(params))
+
+    def cellValues(self, rows, cols):
+        """Return the values of the cells (rows, cols), nan where undefined."""
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        values = np.full((len(self.bands),) + rows.shape, np.nan)
+        inside = ((rows >= 0) & (rows < self.nrows) &
+                  (cols >= 0) & (cols < self.ncols))
+        if inside.any():
+            values[:, inside] = self._insideValues(rows[inside], cols[inside])
+        return values if self.multiband else values[0]
+
+    @property
+    def multiband(self):
+        return isinstance(self.band, (tuple, list))
+
+    def _insideValues(self, rows_in, cols_in):
+        """Return the (bands, positions) values of cells inside the raster."""
+        tilesperrow = (self.ncols + self.tileWidth - 1) // self.tileWidth
+        tilekeys = ((rows_in // self.tileHeight) * tilesperrow +
+                    cols_in // self.tileWidth)
+        uniquekeys, inverse = np.unique(tilekeys, return_inverse=True)
+        # group the positions by tile
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order],
+                                 np.arange(len(uniquekeys) + 1))
+        inside_values = np.empty((len(self.bands), len(rows_in)))
+        for n, key in enumerate(uniquekeys):
+            members = order[bounds[n]:bounds[n + 1]]
+            tilerow, tilecol = divmod(int(key), tilesperrow)
+            tile, bitmapblocks = self._tile(tilerow, tilecol)
+            tilerows = rows_in[members] - tilerow * self.tileHeight
+            tilecols = cols_in[members] - tilecol * self.tileWidth
+            # tiles are (rows, cols, bands) arrays
+            inside_values[:, members] = tile[tilerows, tilecols].T
+            for b, bitmapblock in enumerate(bitmapblocks or []):
+                if bitmapblock is None:
+                    continue
+                # nodata is only known through the block's bitmap
+                for m, row, col in zip(members, tilerows, tilecols):
+                    if bitmapblock.isNoData(int(row), int(col)):
+                        inside_values[b, m] = np.nan
+            if self.progress is not None:
+                self.progress((100 * (n + 1)) // len(uniquekeys))
+        if self.nodata is not None:
+            inside_values[inside_values == self.nodata] = np.nan
+        return inside_values
+
+    def _tile(self, tilerow, tilecol):
+        key = (tilerow, tilecol)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+        else:
+            self._tiles[key] = self._readTile(tilerow, tilecol)
+            if self.maxTiles is not None and len(self._tiles) > self.maxTiles:
+                self._tiles.popitem(last=False)
+        return self._tiles[key]
+
+    def _readTile(self, tilerow, tilecol):
+        """Read one grid-aligned tile with a single block() call per band.
+
+        Return the (rows, cols, bands) array of the tile, and the blocks
+        whose nodata is only known through their bitmap, else None.
+        """
+        row0 = tilerow * self.tileHeight
+        col0 = tilecol * self.tileWidth
+        height = min(self.tileHeight, self.nrows - row0)
+        width = min(self.tileWidth, self.ncols - col0)
+        extent = QgsRectangle(self.xmin + col0 * self.resx,
+                              self.ymax - (row0 + height) * self.resy,
+                              self.xmin + (col0 + width) * self.resx,
+                              self.ymax - row0 * self.resy)
+        arrays = []
+        bitmapblocks = []
+        for band in self.bands:
+            block = self.provider.block(band, extent, width, height)
+            arrays.append(blockToArray(block, width, height))
+            if (not block.isEmpty() and not block.hasNoDataValue()
+                    and block.hasNoData()):
+                bitmapblocks.append(block)
+            else:
+                bitmapblocks.append(None)
+        if not any(block is not None for block in bitmapblocks):
+            bitmapblocks = None
+        return np.dstack(arrays), bitmapblocks
+
+
+class MemmapRasterSampler(RasterBlockSampler):
+    """RasterBlockSampler reading an uncompressed local GeoTIFF directly.
+
+    The tiles are the GeoTIFF blocks (tiles or strips) of the band,
+    mapped in memory with numpy: reading a tile costs no copy nor decoding,
+    only the sampled cells are read from the file. Needs the GDAL python
+    bindings to find the blocks in the file, see create().
+    The blocks of a pixel interleaved GeoTIFF hold all its bands: several
+    bands are then read from the same mapped block.
+    """
+
+    GDAL_TYPES = {} if gdal is None else {
+        gdal.GDT_Byte: np.uint8,
+        gdal.GDT_UInt16: np.uint16,
+        gdal.GDT_Int16: np.int16,
+        gdal.GDT_UInt32: np.uint32,
+        gdal.GDT_Int32: np.int32,
+        gdal.GDT_Float32: np.float32,
+        gdal.GDT_Float64: np.float64}
+
+    def __init__(self, provider, band, dataset, progress=None, maxTiles=None):
+        RasterBlockSampler.__init__(self, provider, band, progress, maxTiles)
+        self.path = dataset.GetDescription()
+        self.dataset = dataset      # the band is only valid with its dataset
+        self.gdalbands = [dataset.GetRasterBand(b) for b in self.bands]
+        self.gdalband = self.gdalbands[0]
+        self.tileWidth, self.tileHeight = self.gdalband.GetBlockSize()
+        # the whole file is mapped once, the blocks are views of it: a
+        # mapping per block would hold a file descriptor per cached tile
+        self.data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        dtype = np.dtype(self.GDAL_TYPES[self.gdalband.DataType])
+        if bytes(self.data[:2]) == b"MM":
+            dtype = dtype.newbyteorder(">")
+        else:
+            dtype = dtype.newbyteorder("<")
+        self.dtype = dtype
+        # pixel interleaved blocks hold all the bands
+        self.bandcount = 1
+        if (dataset.RasterCount > 1 and dataset.GetMetadataItem(
+                "INTERLEAVE", "IMAGE_STRUCTURE") == "PIXEL"):
+            self.bandcount = dataset.RasterCount
+        nodata = self.gdalband.GetNoDataValue()
+        if nodata is not None:
+            # compare with the value stored in the cells, e.g. rounded to
+            # float32; an integer band can't hold a value out of its range
+            with np.errstate(over="ignore", invalid="ignore"):
+                stored = float(np.array(nodata).astype(self.dtype))
+            if dtype.kind in "iu" and stored != nodata:
+                stored = None
+            nodata = stored
+        self.nodata = nodata
+
+    @classmethod
+    def create(cls, provider, band, progress=None, maxTiles=None):
+        """Return a MemmapRasterSampler of provider, or None if its data
+        can't be mapped: GDAL bindings missing, remote or non GeoTIFF
+        source, compression, bit-packed samples, scaling or user nodata
+        values."""
+        if gdal is None or provider is None or provider.name() != "gdal":
+            return None
+        path = provider.dataSourceUri().split("|")[0]
+        if not os.path.isfile(path):
+            return None
+        bands = band if isinstance(band, (tuple, list)) else (band,)
+        for b in bands:
+            if provider.userNoDataValues(b):
+                return None
+            if not provider.useSourceNoDataValue(b) and provider.sourceHasNoDataValue(b):
+                return None
+        dataset = gdal.Open(path)
+        if (dataset is None or dataset.GetDriver().ShortName != "GTiff" or
+                dataset.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE")
+                not in (None, "NONE") or
+                # 1 to 31 bits samples packed in bytes
+                dataset.GetMetadataItem("NBITS", "IMAGE_STRUCTURE") is not None or
+                dataset.RasterXSize != provider.xSize() or
+                dataset.RasterYSize != provider.ySize()):
+            return None
+        first = dataset.GetRasterBand(bands[0])
+        for b in bands:
+            gdalband = dataset.GetRasterBand(b)
+            if (gdalband.DataType not in cls.GDAL_TYPES or
+                    gdalband.GetMetadataItem("NBITS", "IMAGE_STRUCTURE") is not None or
+                    (gdalband.GetScale() or 1) != 1 or
+                    (gdalband.GetOffset() or 0) != 0 or
+                    # the bands are read as a single array
+                    gdalband.DataType != first.DataType or
+                    gdalband.GetBlockSize() != first.GetBlockSize() or
+                    gdalband.GetNoDataValue() != first.GetNoDataValue()):
+                return None
+        return cls(provider, band, dataset, progress, maxTiles)
+
+    def _readTile(self, tilerow, tilecol):
+        """Map one GeoTIFF block of the bands."""
+        height = min(self.tileHeight, self.nrows - tilerow * self.tileHeight)
+        width = min(self.tileWidth, self.ncols - tilecol * self.tileWidth)
+        if self.bandcount > 1:
+            # pixel interleaved: one block for all the bands
+            block = self._mapBlock(self.gdalband, tilerow, tilecol, height)
+            if block is None:
+                return np.full((height, width, len(self.bands)), np.nan), None
+            first = self.bands[0] - 1
+            if self.bands == tuple(range(self.bands[0], self.bands[0] + len(self.bands))):
+                return block[:height, :width, first:first + len(self.bands)], None
+            return block[:height, :width, [b - 1 for b in self.bands]], None
+        arrays = []
+        for gdalband in self.gdalbands:
+            block = self._mapBlock(gdalband, tilerow, tilecol, height)
+            if block is None:
+                block = np.full((height, self.tileWidth, 1), np.nan)
+            arrays.append(block[:height, :width])
+        if len(arrays) == 1:
+            return arrays[0], None
+        return np.concatenate(arrays, axis=2), None
+
+    def _mapBlock(self, gdalband, tilerow, tilecol, height):
+        """Return the (height, tileWidth, bandcount) view of the mapped
+        file on a block of gdalband, or None if the block was never written (sparse file)."""
+        offset = gdalband.GetMetadataItem(
+            "BLOCK_OFFSET_%d_%d" % (tilecol, tilerow), "TIFF")
+        if not offset or int(offset) == 0:
+            return None
+        # only the rows inside the raster are mapped: the last strip has no
+        # more, but right side tiles are stored with their whole width
+        return np.ndarray((height, self.tileWidth, self.bandcount),
+                          dtype=self.dtype, buffer=self.data,
+                          offset=int(offset))
+
+
+def overviewFactors(provider):
+    """Return the sorted decimation factors of the overviews of provider,
+    starting with 1 for the full resolution."""
+    factors = [1]
+    try:
+        pyramids = provider.buildPyramidList()
+    except AttributeError:
+        return factors
+    for pyramid in pyramids:
+        if hasattr(pyramid, "getExists"):
+            # QGIS >= 3.26
+            exists, xsize = pyramid.getExists(), pyramid.getXSize()
+        else:
+            exists, xsize = pyramid.exists, pyramid.xDim
+        if exists and xsize > 0:
+            factors.append(provider.xSize() / xsize)
+    return sorted(set(factors))
+
+
+def createSampler(provider, band, progress=None, maxTiles=None):
+    """Return the best sampler of provider: a MemmapRasterSampler if its
+    data can be mapped, else a RasterBlockSampler if it has a fixed grid,
+    else None."""
+    sampler = MemmapRasterSampler.create(provider, band, progress, maxTiles)
+    if sampler is None and RasterBlockSampler.canSample(provider):
+        sampler = RasterBlockSampler(provider, band, progress, maxTiles)
+    return sampler
+
+
+def blockToArray(block, width, height):
+    """Convert a QgsRasterBlock to a float64 (height, width) array.
+
+    Cells equal to the block's nodata value are set to nan.
+    """
+    if block is None or block.isEmpty() or block.dataType() not in DATA_TYPES:
+        return np.full((height, width), np.nan)
+    data = np.frombuffer(bytes(block.data()),
+                         dtype=DATA_TYPES[block.dataType()])
+    array = data.reshape(height, width).astype(np.float64)
+    if block.hasNoDataValue():
+        array[array == block.noDataValue()] = np.nan
+    return array
@@ -34,7 +34,10 @@ from qgis.core import *
 from qgis.gui import *
 #plugin import
 from .plottingtool import *
-from .utils import isProfilable
+from .utils import curveKey, isProfilable, parseBand
+
+# band selector choice of the rows reading all the bands of a raster
+ALL_BANDS = "All bands"
 
 
 class TableViewTool(QtCore.QObject):
@@ -98,13 +101,17 @@ class TableViewTool(QtCore.QObject):
             listband = []
             for i in range(0,layer2.bandCount()):
                 listband.append(str(i+self.bandoffset))
+            #one row reading all the bands together
+            listband.append(ALL_BANDS)
             testqt, ok = QInputDialog.getItem(
                 iface.mainWindow(),
                 typename.capitalize() + " selector",
                 "Choose the " + typename,
                 listband,
                 False)
-            if ok :
+            if ok and testqt == ALL_BANDS:
+                choosenBand = ','.join(listband[:-1])
+            elif ok :
                 choosenBand = int(testqt) - self.bandoffset
             else:
                 return 2
@@ -154,7 +161,10 @@ class TableViewTool(QtCore.QObject):
         mdl.item(row,1).setFlags(QtCore.Qt.NoItemFlags)
         mdl.setData( mdl.index(row, 2, QModelIndex())  ,layer2.name())
         mdl.item(row,2).setFlags(QtCore.Qt.NoItemFlags)
-        mdl.setData( mdl.index(row, 3, QModelIndex())  ,choosenBand + self.bandoffset)
+        if isinstance(choosenBand, str):
+            mdl.setData( mdl.index(row, 3, QModelIndex())  ,choosenBand)
+        else:
+            mdl.setData( mdl.index(row, 3, QModelIndex())  ,choosenBand + self.bandoffset)
         mdl.item(row,3).setFlags(QtCore.Qt.NoItemFlags)
 
         if layer2.type() == layer2.VectorLayer :
@@ -188,7 +198,11 @@ class TableViewTool(QtCore.QObject):
             
         else:
             mdl.setData(mdl.index(row, 4, QModelIndex()), '')
-            mdl.item(row,4).setFlags(QtCore.Qt.NoItemFlags)
+            if layer2.type() == layer2.RasterLayer:
+                #width of the swath, none for a single line profile
+                mdl.item(row,4).setFlags(QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsEditable)
+            else:
+                mdl.item(row,4).setFlags(QtCore.Qt.NoItemFlags)
             mdl.setData(mdl.index(row, 5, QModelIndex()), '')
             mdl.item(row,5).setFlags(QtCore.Qt.NoItemFlags)
             mdl.setData(mdl.index(row, 6, QModelIndex()), '')
@@ -229,15 +243,15 @@ class TableViewTool(QtCore.QObject):
     def onClick(self, iface, wdg, mdl, plotlibrary, index1):                    #action when clicking the tableview
         temp = mdl.itemFromIndex(index1)
         layer = mdl.index(index1.row(),8).data()
+        #curves of the row, see PlottingTool.attachCurves
+        name = curveKey(layer, parseBand(mdl.item(index1.row(),3).data(QtCore.Qt.EditRole)))
         if index1.column() == 1:                #modifying color
-            name = ("%s#%d") % (mdl.item(index1.row(),2).data(QtCore.Qt.EditRole), mdl.item(index1.row(),3).data(QtCore.Qt.EditRole))
             color = QColorDialog().getColor(temp.data(QtCore.Qt.BackgroundRole))
             mdl.setData( mdl.index(temp.row(), 1, QModelIndex())  ,color , QtCore.Qt.BackgroundRole)
             mdl.setData(mdl.index(temp.row(), 7, QModelIndex()), 'Selected')
             PlottingTool().changeColor(wdg, plotlibrary, mdl, color, name)
         elif index1.column() == 0:                #modifying checkbox
             #name = mdl.item(index1.row(),2).data(Qt.EditRole)
-            name = ("%s#%d") % (mdl.item(index1.row(),2).data(QtCore.Qt.EditRole), mdl.item(index1.row(),3).data(QtCore.Qt.EditRole))
             booltemp = temp.data(QtCore.Qt.CheckStateRole)
             if booltemp == True:
                 booltemp = False
@@ -246,7 +260,6 @@ class TableViewTool(QtCore.QObject):
             mdl.setData( mdl.index(temp.row(), 0, QModelIndex())  ,booltemp, QtCore.Qt.CheckStateRole)
             PlottingTool().changeAttachCurve(wdg, plotlibrary, booltemp, name)
         elif index1.column() == 5:                
-            name = ("%s#%d") % (mdl.item(index1.row(),2).data(QtCore.Qt.EditRole), mdl.item(index1.row(),3).data(QtCore.Qt.EditRole))
             linetype = mdl.index(index1.row(),5).data()
             flags = mdl.item(index1.row(),6).flags()
             if linetype == 'Line':
@@ -261,7 +274,6 @@ class TableViewTool(QtCore.QObject):
             mdl.setData(mdl.index(temp.row(), 5, QModelIndex()), linetype)
             PlottingTool().changeDataPlot(wdg, plotlibrary, mdl, linetype, name)
         elif index1.column() == 6:  
-            name = ("%s#%d") % (mdl.item(index1.row(),2).data(QtCore.Qt.EditRole), mdl.item(index1.row(),3).data(QtCore.Qt.EditRole))
             dotSize = mdl.index(index1.row(),6).data()
             linetype = mdl.index(index1.row(),5).data()
             if (dotSize == 'Standard') & (linetype == 'Point'):
@@ -271,7 +283,6 @@ class TableViewTool(QtCore.QObject):
             mdl.setData(mdl.index(temp.row(), 6, QModelIndex()), dotSize)
             PlottingTool().changeDataPlotSize(wdg, plotlibrary, mdl, layer, dotSize, name)
         elif index1.column() == 7:  
-            name = ("%s#%d") % (mdl.item(index1.row(),2).data(QtCore.Qt.EditRole), mdl.item(index1.row(),3).data(QtCore.Qt.EditRole))
             dotColor = mdl.index(index1.row(),7).data()
             linetype = mdl.index(index1.row(),5).data()
             if (dotColor == 'Selected') & (linetype == 'Point'):
@@ -25,6 +25,7 @@
 
 import qgis
 from qgis.PyQt import QtCore
+import numpy as np
 
 def isRunningQGisVersionGE(major, minor):
     """ Returns True if current QGis version is greater or equal than given major.minor version"""
@@ -56,3 +57,52 @@ def isProfilable(layer):
                (layer.type() == layer.PluginLayer and layer.LAYER_TYPE == 'selafin_viewer')
                     
     
+
+def parseBand(value):
+    """ Returns the band of a table row: an int, or a tuple of bands for the
+    multi-band rows, whose band column holds "1,2,3"
+    """
+    if isinstance(value, str):
+        bands = tuple(int(band) for band in value.split(','))
+        return bands if len(bands) > 1 else bands[0]
+    return value
+
+def bandLabel(band):
+    """ Returns the label of band in the curve names, see parseBand
+    """
+    if isinstance(band, (tuple, list)):
+        return ','.join(str(b) for b in band)
+    return str(band)
+
+def curveKey(layer, band):
+    """ Returns the name of the curve of the profile of band of layer, unique
+    among the table rows, see PlottingTool.attachCurves
+    """
+    return '%s#%s' % (layer.id(), bandLabel(band))
+
+def nearestSample(item, value):
+    """ Returns the index of the sample of the PlotDataItem item whose x is
+    the nearest to value, or None if it has no data. The sorted x values are
+    kept on the item until its data is set again, so each call is a binary
+    search
+    """
+    x = item.xData
+    if x is None or len(x) == 0:
+        return None
+    index = getattr(item, 'chainageIndex', None)
+    if index is None or index[0] is not x:
+        if np.all(x[1:] >= x[:-1]):
+            order = None
+            sortedx = x
+        else:
+            # nan values are sorted last, and left out
+            order = np.argsort(x, kind='stable')[:np.count_nonzero(~np.isnan(x))]
+            sortedx = x[order]
+        index = item.chainageIndex = (x, order, sortedx)
+    x, order, sortedx = index
+    if len(sortedx) == 0:
+        return None
+    i = int(np.searchsorted(sortedx, value))
+    if i == len(sortedx) or (i > 0 and value - sortedx[i - 1] <= sortedx[i] - value):
+        i -= 1
+    return i if order is None else int(order[i])
@@ -99,7 +99,7 @@ class PTDockWidget(QDockWidget, FormClass):
         hh = self.tableView.horizontalHeader()
         hh.setStretchLastSection(True)
         self.tableView.setColumnHidden(8 , True)
-        self.mdl.setHorizontalHeaderLabels(["","","Layer","Band/Field","Search buffer","Data","Point Size","Point Color"])
+        self.mdl.setHorizontalHeaderLabels(["","","Layer","Band/Field","Search buffer/Swath","Data","Point Size","Point Color"])
         self.tableViewTool = TableViewTool()
 
         #other
@@ -110,6 +110,7 @@ class PTDockWidget(QDockWidget, FormClass):
 
         #Signals
         self.butSaveAs.clicked.connect(self.saveAs)
+        self.butTimeSeries.clicked.connect(self.profiletoolcore.showTimeSeries)
         self.tableView.clicked.connect(self._onClick)
         self.mdl.itemChanged.connect(self._onChange)
         self.pushButton_2.clicked.connect(self.addLayer)
@@ -123,6 +124,8 @@ class PTDockWidget(QDockWidget, FormClass):
 
         self.fullResolutionCheckBox.stateChanged.connect(self.refreshPlot)
         self.profileInterpolationCheckBox.stateChanged.connect(self.refreshPlot)
+        self.cellCrossingCheckBox.stateChanged.connect(self.refreshPlot)
+        self.interpolationComboBox.currentIndexChanged.connect(self.refreshPlot)
 
     #********************************************************************************
     #init things ****************************************************************
@@ -264,6 +267,7 @@ class PTDockWidget(QDockWidget, FormClass):
 
     def plotRangechanged(self, param = None):                         # called when pyqtgraph view changed
         PlottingTool().plotRangechanged(self,  self.cboLibrary.currentText () )
+        self.profiletoolcore.plotZoomed()
 
 
     def reScalePlot(self, param):                         # called when a spinbox value changed
@@ -289,34 +293,16 @@ class PTDockWidget(QDockWidget, FormClass):
                 self.showcursor = True
                 self.profiletoolcore.doTracking = bool(self.checkBox_mpl_tracking.checkState() )
                 self.checkBox_mpl_tracking.setEnabled(True)
-                for item in self.plotWdg.allChildItems():
-                    if str(type(item)) == "<class 'profiletool.pyqtgraph.graphicsItems.InfiniteLine.InfiniteLine'>":
-                        if item.name() == 'cross_vertical':
-                            item.show()
-                        elif item.name() == 'cross_horizontal':
-                            item.show()
-                    elif str(type(item)) == "<class 'profiletool.pyqtgraph.graphicsItems.TextItem.TextItem'>":
-                        if item.textItem.toPlainText()[0] == 'X':
-                            item.show()
-                        elif item.textItem.toPlainText()[0] == 'Y':
-                            item.show()
+                for item in self.plotWdg.crosshair.values():
+                    item.show()
             elif int1 == 0 :
                 self.showcursor = False
                 self.profiletoolcore.doTracking = False
                 self.checkBox_mpl_tracking.setEnabled(False)
 
 
-                for item in self.plotWdg.allChildItems():
-                    if str(type(item)) == "<class 'profiletool.pyqtgraph.graphicsItems.InfiniteLine.InfiniteLine'>":
-                        if item.name() == 'cross_vertical':
-                            item.hide()
-                        elif item.name() == 'cross_horizontal':
-                            item.hide()
-                    elif str(type(item)) == "<class 'profiletool.pyqtgraph.graphicsItems.TextItem.TextItem'>":
-                        if item.textItem.toPlainText()[0] == 'X':
-                            item.hide()
-                        elif item.textItem.toPlainText()[0] == 'Y':
-                            item.hide()
+                for item in self.plotWdg.crosshair.values():
+                    item.hide()
             self.profiletoolcore.plotProfil()
 
     #********************************************************************************
@@ -334,7 +320,10 @@ class PTDockWidget(QDockWidget, FormClass):
         self.tableViewTool.addLayer(self.iface, self.mdl, layer1)
         self.profiletoolcore.updateProfil(self.profiletoolcore.pointstoDraw,
                                           False)
+        layer1.dataChanged.connect(self.forgetLayerData)
         layer1.dataChanged.connect(self.refreshPlot)
+        if layer1.type() == qgis.core.QgsMapLayer.VectorLayer:
+            layer1.afterCommitChanges.connect(self.forgetLayerData)
 
 
     def removeLayer(self, index=None):
@@ -343,15 +332,25 @@ class PTDockWidget(QDockWidget, FormClass):
             index = self.tableViewTool.chooseLayerForRemoval(self.iface, self.mdl)
 
         if index is not None:
-            layer = self.mdl.index(index, 7).data()
+            layer = self.mdl.item(index, 8).data(QtCore.Qt.EditRole)
             try:
+                self.profiletoolcore.profileCache.removeLayer(layer.id())
+                layer.dataChanged.disconnect(self.forgetLayerData)
                 layer.dataChanged.disconnect(self.refreshPlot)
+                layer.afterCommitChanges.disconnect(self.forgetLayerData)
             except:
                 pass
             self.tableViewTool.removeLayer(self.mdl, index)
         self.profiletoolcore.updateProfil(self.profiletoolcore.pointstoDraw,
                                           False, True)
 
+    def forgetLayerData(self):
+        # the data of the layer sending the signal has changed: what was
+        # computed from it is out of date
+        layer = self.sender()
+        if layer is not None:
+            self.profiletoolcore.profileCache.removeLayer(layer.id())
+
     def refreshPlot(self):
         #
         #    Refreshes/updates the plot without requiring the user to
@@ -371,8 +370,13 @@ class PTDockWidget(QDockWidget, FormClass):
         if (not self.mdl.item(item.row(),8) is None
                 and item.column() ==4
                 and self.mdl.item(item.row(),8).data(QtCore.Qt.EditRole).type() == qgis.core.QgsMapLayer.VectorLayer):
-
-            self.profiletoolcore.plotProfil()
+            #search buffer changed: the points within it are read again
+            self.refreshPlot()
+        elif (not self.mdl.item(item.row(),8) is None
+                and item.column() ==4
+                and self.mdl.item(item.row(),8).data(QtCore.Qt.EditRole).type() == qgis.core.QgsMapLayer.RasterLayer):
+            #swath width changed
+            self.refreshPlot()
 
     #********************************************************************************
     #coordinate tab ****************************************************************
@@ -381,7 +385,9 @@ class PTDockWidget(QDockWidget, FormClass):
     def _profile_name(profile):
         groupTitle = profile["layer"].name()
         band = profile["band"]
-        if band is not None and band > -1:
+        if isinstance(band, tuple):
+            groupTitle += '_bands_{}'.format('_'.join(str(b) for b in band))
+        elif band is not None and band > -1:
             groupTitle += '_band_{}'.format(band)
         return groupTitle.replace(' ', '_')
 
@@ -404,7 +410,8 @@ class PTDockWidget(QDockWidget, FormClass):
         self.tolayerPushButton = []
         self.tableView = []
         self.verticalLayout = []
-        if self.mdl.rowCount() != self.profiletoolcore.profiles:
+        if (self.profiletoolcore.profiles is None or
+                self.mdl.rowCount() != len(self.profiletoolcore.profiles)):
             # keep the number of profiles and the model in sync.
             self.profiletoolcore.updateProfil(
                 self.profiletoolcore.pointstoDraw, False, False)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#-----------------------------------------------------------
+#
+# Profile
+# Copyright (C) 2008  Borys Jurgiel
+# Copyright (C) 2012  Patrice Verchere
+#-----------------------------------------------------------
+#
+# licensed under the terms of GNU GPL 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, print to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#---------------------------------------------------------------------
+
+from qgis.PyQt import QtCore
+from qgis.PyQt.QtWidgets import (QDialog, QHBoxLayout, QLabel, QPushButton,
+                                 QSlider, QVBoxLayout)
+
+import numpy as np
+
+from .. import pyqtgraph as pg
+
+
+class TimeSeriesDialog(QDialog):
+    """Show the profile time series computed by
+    DataReaderTool.timeSeriesReaderTool.
+
+    The values along the profile versus time are drawn as an image, and
+    the profile of the current time step as a curve below it, which can
+    be animated. The image columns are regularly spaced along the
+    profile, each one taking its nearest sample, and its rows regularly
+    spaced in time, each one taking the last step started, so that
+    irregular time steps are drawn at their own time.
+    """
+
+    FRAME_INTERVAL = 100    # ms between two steps of the animation
+    MAX_ROWS = 2000         # image rows of irregular time steps
+
+    def __init__(self, profile, mesh, parent=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Profile time series - %s" % profile["layer"].name())
+        self.profile = profile
+        self.l = np.asarray(profile["l"], dtype=np.float64)
+        self.times = profile["times"]
+        self.series = profile["series"]
+        steplabel = "Time (h)" if mesh else "Band"
+
+        self.graphics = pg.GraphicsLayoutWidget()
+        self.imagePlot = self.graphics.addPlot(row=0, col=0)
+        self.imagePlot.setLabel('left', steplabel)
+        self.image = pg.ImageItem()
+        self.imagePlot.addItem(self.image)
+        histogram = pg.HistogramLUTItem()
+        histogram.setImageItem(self.image)
+        histogram.gradient.loadPreset('viridis')
+        self.graphics.addItem(histogram, row=0, col=1)
+        self.stepLine = pg.InfiniteLine(angle=0, pen=pg.mkPen('r', width=1))
+        self.imagePlot.addItem(self.stepLine)
+        self.curvePlot = self.graphics.addPlot(row=1, col=0)
+        self.curvePlot.setLabel('bottom', "Distance")
+        self.curvePlot.setXLink(self.imagePlot)
+        self.curve = self.curvePlot.plot(pen=pg.mkPen('b', width=2))
+        finite = self.series[np.isfinite(self.series)]
+        if len(finite):
+            self.curvePlot.setYRange(finite.min(), finite.max())
+        self.curvePlot.enableAutoRange(axis='y', enable=False)
+
+        self.slider = QSlider(QtCore.Qt.Horizontal)
+        self.slider.setRange(0, len(self.times) - 1)
+        self.stepLabel = QLabel()
+        self.playButton = QPushButton("Play")
+        self.playButton.setCheckable(True)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(self.FRAME_INTERVAL)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.playButton)
+        controls.addWidget(self.slider)
+        controls.addWidget(self.stepLabel)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.graphics)
+        layout.addLayout(controls)
+        self.resize(800, 600)
+
+        self.slider.valueChanged.connect(self.showStep)
+        self.playButton.toggled.connect(self.play)
+        self.timer.timeout.connect(self.nextStep)
+
+        self.setImage()
+        self.showStep(0)
+
+    def setImage(self):
+        if len(self.l) < 2:
+            return
+        # regular columns along the profile, each with its nearest sample
+        columns = min(len(self.l), 2000)
+        distances = np.linspace(self.l[0], self.l[-1], columns)
+        after = np.clip(np.searchsorted(self.l, distances), 1, len(self.l) - 1)
+        before = after - 1
+        nearest = np.where(distances - self.l[before] < self.l[after] - distances,
+                           before, after)
+        # regular rows in time, each with the step shown at its time
+        steps = self._imageSteps()
+        # col-major image: image[column, row]
+        self.image.setImage(self.series[steps][:, nearest].T, autoLevels=True)
+        start, stop = self.times[0], self.times[-1]
+        if len(steps) > 1 and stop > start:
+            # the last step is shown during one row
+            stop += (stop - start) / (len(steps) - 1)
+        height = (stop - start) if stop != start else 1.
+        self.image.setRect(QtCore.QRectF(self.l[0], start, self.l[-1] - self.l[0], height))
+
+    def _imageSteps(self):
+        """Return the step of each image row: the steps themselves if they
+        are regularly spaced, else regular rows down to the shortest step."""
+        times = np.asarray(self.times, dtype=np.float64)
+        steps = np.arange(len(times))
+        if len(times) < 3:
+            return steps
+        durations = np.diff(times)
+        if np.allclose(durations, durations[0]) or not np.all(durations > 0):
+            return steps
+        rows = int(min((times[-1] - times[0]) / durations.min(), self.MAX_ROWS)) + 1
+        rowtimes = np.linspace(times[0], times[-1], rows)
+        return np.searchsorted(times, rowtimes, side='right') - 1
+
+    def showStep(self, step):
+        self.curve.setData(self.l, self.series[step], connect='finite')
+        self.stepLine.setValue(self.times[step])
+        self.stepLabel.setText("%g" % self.times[step])
+
+    def play(self, playing):
+        if playing:
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def nextStep(self):
+        self.slider.setValue((self.slider.value() + 1) % len(self.times))
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        QDialog.closeEvent(self, event)